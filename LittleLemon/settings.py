@@ -41,7 +41,6 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'djoser',
     'django_filters',
-    'LittleLemonAPI.signals',
     'LittleLemonAPI',
 ]
 
@@ -53,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'LittleLemonAPI.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'LittleLemon.urls'
@@ -86,6 +86,11 @@ DATABASES = {
     }
 }
 
+# Carts and orders are placed by user across the aliases of LITTLE_LEMON['SHARDS']
+# (e.g. 'shard0', 'shard1' defined above, each migrated with
+# `python manage.py migrate --database shard0`); the other tables stay in default
+DATABASE_ROUTERS = ['LittleLemonAPI.sharding.ShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -154,4 +159,72 @@ REST_FRAMEWORK = {
 
 DJOSER = {
     'USER_ID_FIELD': 'username'
-}
\ No newline at end of file
+}
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Write-back cart store: the cache must be shared by all the processes (use
+    # Redis or Memcached in production) and must not cull dirty carts before
+    # they are written back
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'carts',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+LITTLE_LEMON = {
+    # 'LittleLemonAPI.cart_store.DatabaseCartStore' keeps the carts in the Cart table,
+    # 'LittleLemonAPI.cart_store.CachedCartStore' keeps them in CART_CACHE_ALIAS
+    # (a cache shared by all the processes) and writes them back to the Cart table
+    # on the first cart write after CART_FLUSH_INTERVAL seconds,
+    # 'LittleLemonAPI.cart_store.CoalescingCartStore' commits the cart writes made
+    # within CART_COALESCE_WINDOW seconds (at most CART_COALESCE_MAX_BATCH of them)
+    # in one transaction, a request waits CART_COALESCE_TIMEOUT seconds at most
+    'CART_STORE': 'LittleLemonAPI.cart_store.DatabaseCartStore',
+    'CART_CACHE_ALIAS': 'carts',
+    'CART_FLUSH_INTERVAL': 5,
+    'CART_COALESCE_WINDOW': 0.002,
+    'CART_COALESCE_MAX_BATCH': 100,
+    'CART_COALESCE_TIMEOUT': 10,
+    # Cache of the user roles and of the resource versions behind the ETags.
+    # Roles are only cached, and conditional GETs only answered with 304, when
+    # it is shared by all the workers (e.g. Redis or Memcached): with a local
+    # memory cache a worker would not see the changes made by the others.
+    'CACHE_ALIAS': 'default',
+    'ROLES_TIMEOUT': 300,
+    'CONDITIONAL_GET': True,
+    'MENU_TIMEOUT': 3600,
+    # Build the URL resolver, serializers, renderers and caches when a worker
+    # imports LittleLemon.wsgi / LittleLemon.asgi instead of on its first requests
+    'WARM_UP': not DEBUG,
+    # Staff users profile a request with an X-Profile: 1 header or ?profile=1;
+    # PROFILE_SAMPLE_RATE profiles this fraction of all requests
+    'PROFILE_DIR': BASE_DIR / 'profiles',
+    'PROFILE_SAMPLE_RATE': 0,
+    'PROFILE_KEEP': 200,
+    # Database aliases of the cart and order shards, empty to keep them in default.
+    # Changing the shards of an existing database needs the rows to be moved.
+    # With several shards the order lists of managers and delivery crews can only
+    # be ordered by the columns of the orders (?ordering=user__username is a 400).
+    'SHARDS': [],
+    # manage.py maintenance: carts untouched for CART_MAX_AGE_DAYS and tokens older
+    # than TOKEN_MAX_AGE_DAYS (None keeps them) are deleted MAINTENANCE_BATCH_SIZE
+    # rows at a time, pausing MAINTENANCE_PAUSE seconds between two batches
+    'CART_MAX_AGE_DAYS': 7,
+    'TOKEN_MAX_AGE_DAYS': None,
+    'MAINTENANCE_BATCH_SIZE': 500,
+    'MAINTENANCE_PAUSE': 0.05,
+    # POST /api/batch: at most BATCH_MAX_REQUESTS sub-requests, the reads of a
+    # batch with "parallel": true run on up to BATCH_MAX_WORKERS threads
+    'BATCH_MAX_REQUESTS': 20,
+    'BATCH_MAX_WORKERS': 4,
+    # Menu imports (POST /api/menu-items/import, manage.py import_menu) validate
+    # and write MENU_IMPORT_CHUNK_SIZE rows per transaction
+    'MENU_IMPORT_CHUNK_SIZE': 200,
+}
@@ -0,0 +1,20 @@
+import json
+import os
+
+from .settings import *
+
+
+# Settings of the server started by manage.py loadtest: it runs on the copies of
+# the databases made by the command and without throttling, so the run never
+# writes to the project data and the report measures the API, not the throttles
+
+for alias, name in json.loads(os.environ.get('LITTLE_LEMON_LOADTEST_DATABASES', '{}')).items():
+    DATABASES[alias] = {**DATABASES[alias], 'NAME': name}
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': None,
+        'user': None,
+    },
+}
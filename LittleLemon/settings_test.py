@@ -0,0 +1,11 @@
+from .settings import *
+
+
+# Settings of the test suite: a second database for the sharding tests, which
+# are skipped with the project settings
+# python manage.py test LittleLemonAPI --settings LittleLemon.settings_test
+
+DATABASES = {
+    **DATABASES,
+    'shard1': {**DATABASES['default'], 'NAME': BASE_DIR / 'shard1.sqlite3'},
+}
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LittleLemon.settings')
 
 application = get_wsgi_application()
+
+# Pay the first request costs at worker boot (LITTLE_LEMON['WARM_UP'])
+from LittleLemonAPI.conf import get_setting
+
+if get_setting('WARM_UP'):
+    from LittleLemonAPI.warmup import warm_up
+    warm_up()
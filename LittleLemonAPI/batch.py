@@ -0,0 +1,114 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.db import connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.response import Response
+
+from .conf import get_setting
+
+
+logger = logging.getLogger(__name__)
+
+# Request metadata the sub-requests inherit from the batch request
+INHERITED_META = ('REMOTE_ADDR', 'SERVER_NAME', 'SERVER_PORT', 'HTTP_HOST', 'HTTP_ACCEPT_LANGUAGE',
+                  'HTTP_X_FORWARDED_FOR', 'wsgi.url_scheme')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class BatchError(Exception):
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# Build the HttpRequest of a sub-request ({"method", "path", "body", "headers"}),
+# authenticated as the user of the batch request
+def build_request(request, spec, batch_view):
+    if not isinstance(spec, dict) or not isinstance(spec.get('path'), str):
+        raise BatchError('Every request needs a path')
+    headers = spec.get('headers') or {}
+    if not isinstance(headers, dict):
+        raise BatchError('headers must be an object')
+    method = str(spec.get('method', 'GET')).upper()
+    url = urlsplit(spec['path'])
+    if not url.path.startswith('/api/'):
+        raise BatchError('Only /api/ routes can be batched')
+    try:
+        match = resolve(url.path)
+    except Resolver404:
+        raise BatchError('The route does not exist', status.HTTP_404_NOT_FOUND)
+    if match.func is batch_view:
+        raise BatchError('Batches can not be nested')
+
+    sub_request = HttpRequest()
+    sub_request.method = method
+    sub_request.path = sub_request.path_info = url.path
+    sub_request.META = {key: request.META[key] for key in INHERITED_META if key in request.META}
+    sub_request.META.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'HTTP_ACCEPT': 'application/json',
+    })
+    for name, value in headers.items():
+        sub_request.META['HTTP_' + name.upper().replace('-', '_')] = str(value)
+    sub_request.GET = QueryDict(url.query)
+
+    body = json.dumps(spec['body']).encode() if spec.get('body') is not None else b''
+    sub_request.META['CONTENT_TYPE'] = 'application/json'
+    sub_request.META['CONTENT_LENGTH'] = str(len(body))
+    sub_request._stream = BytesIO(body)
+    sub_request._read_started = False
+
+    # Reuse the authentication of the batch request (and the roles memoized on the user)
+    sub_request.user = request.user
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request, match
+
+
+# Run one sub-request through its view, including its throttles and permissions
+def run_one(request, spec, batch_view):
+    try:
+        sub_request, match = build_request(request, spec, batch_view)
+        response = match.func(sub_request, *match.args, **match.kwargs)
+    except BatchError as e:
+        return {'status': e.status_code, 'headers': {}, 'body': {'message': str(e)}}
+    except Exception:
+        logger.exception('Batched request %s failed', spec)
+        return {'status': status.HTTP_500_INTERNAL_SERVER_ERROR, 'headers': {},
+                'body': {'message': 'Internal server error'}}
+
+    if isinstance(response, Response):
+        body = response.data
+    else:
+        try:
+            body = json.loads(response.content) if response.content else None
+        except ValueError:
+            body = response.content.decode(errors='replace')
+    headers = {name: value for name, value in response.items() if name.lower() != 'content-type'}
+    return {'status': response.status_code, 'headers': headers, 'body': body}
+
+
+def _run_in_thread(request, spec, batch_view):
+    try:
+        return run_one(request, spec, batch_view)
+    finally:
+        # Worker threads open their own connections
+        connections.close_all()
+
+
+# Run the sub-requests in order, or the independent reads concurrently
+def run_batch(request, specs, batch_view, parallel=False):
+    reads_only = all(isinstance(spec, dict) and str(spec.get('method', 'GET')).upper() in SAFE_METHODS
+                     for spec in specs)
+    if parallel and reads_only and len(specs) > 1:
+        with ThreadPoolExecutor(max_workers=get_setting('BATCH_MAX_WORKERS')) as executor:
+            return list(executor.map(lambda spec: _run_in_thread(request, spec, batch_view), specs))
+    return [run_one(request, spec, batch_view) for spec in specs]
@@ -0,0 +1,327 @@
+import atexit
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils.module_loading import import_string
+
+from .coalescer import WriteCoalescer
+from .conf import get_setting, is_shared_cache
+from .models import Cart
+from .sharding import get_shards, shard_for_user
+from .versions import bump_on_commit
+
+
+# Keep the carts in the Cart table (every add, read and clear hits the database)
+class DatabaseCartStore:
+
+    # Return the cart items of the user
+    def get_items(self, user):
+        return list(Cart.objects.using(shard_for_user(user.id)).filter(user_id=user.id))
+
+    # Add the menu item to the cart of the user
+    def add_item(self, user, menu_item, quantity):
+        cart_item = Cart(
+            user=user,
+            menuitem=menu_item,
+            quantity=quantity,
+            unit_price=menu_item.price,
+            price=quantity * menu_item.price
+            )
+        cart_item.save(using=shard_for_user(user.id))
+        return cart_item
+
+    # Delete all items from the cart of the user
+    def clear(self, user):
+        Cart.objects.using(shard_for_user(user.id)).filter(user_id=user.id).delete()
+
+    # Empty the cart of the user once the order has been placed
+    def checkout(self, user):
+        self.clear(user)
+
+    # Set the new unit prices (menu item id -> price) on every cart holding these
+    # menu items with one UPDATE per shard, return the ids of the users of the carts
+    def reprice(self, prices):
+        unit_price = Case(
+            *(When(menuitem_id=menu_item_id, then=Value(price)) for menu_item_id, price in prices.items()),
+            output_field=DecimalField(max_digits=6, decimal_places=2))
+        user_ids = set()
+        for shard in get_shards():
+            with transaction.atomic(using=shard):
+                carts = Cart.objects.using(shard).filter(menuitem_id__in=prices)
+                shard_user_ids = set(carts.values_list('user_id', flat=True))
+                if shard_user_ids:
+                    carts.update(unit_price=unit_price, price=F('quantity') * unit_price)
+                    # update() sends no signals
+                    bump_on_commit(*(f'cart:{user_id}' for user_id in shard_user_ids), using=shard)
+            user_ids |= shard_user_ids
+        return user_ids
+
+
+# Keep the carts in the Cart table, committing the additions and the clears of
+# concurrent requests together (see coalescer.py) to spare SQLite one commit
+# and one wait for the writer lock per request
+class CoalescingCartStore(DatabaseCartStore):
+
+    def __init__(self):
+        self.coalescer = WriteCoalescer(get_setting('CART_COALESCE_WINDOW'),
+                                        get_setting('CART_COALESCE_MAX_BATCH'),
+                                        get_setting('CART_COALESCE_TIMEOUT'))
+
+    def add_item(self, user, menu_item, quantity):
+        return self.coalescer.submit(shard_for_user(user.id), super().add_item, user, menu_item, quantity)
+
+    # The clear of a checkout runs in the transaction of the order
+    def clear(self, user):
+        return self.coalescer.submit(shard_for_user(user.id), super().clear, user)
+
+    # Return the batch size and commit latency metrics of the coalescer
+    def stats(self):
+        return self.coalescer.stats()
+
+
+# Hold the lock `key` of a cache shared by several processes for the duration of
+# the block. cache.add() is atomic with Redis, Memcached and the database cache,
+# but FileBasedCache.add() checks and then writes, so with a file-based cache the
+# lock is a file created with O_EXCL next to the entries (in the private
+# FileBasedCache._dir, the lock files are never culled or cleared as entries).
+# A lock left by a killed process expires after `timeout` seconds.
+@contextmanager
+def cache_lock(cache, key, timeout=5):
+    if isinstance(cache, FileBasedCache):
+        path = cache._key_to_file(key) + '.lock'
+
+        def acquire():
+            os.makedirs(cache._dir, exist_ok=True)
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if os.path.getmtime(path) < time.time() - timeout:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+                return False
+
+        def release():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    else:
+        token = uuid.uuid4().hex
+
+        def acquire():
+            return cache.add(key, token, timeout)
+
+        def release():
+            if cache.get(key) == token:
+                cache.delete(key)
+
+    deadline = time.monotonic() + 2 * timeout
+    while not acquire():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'The cache lock {key} is still held after {2 * timeout} seconds')
+        time.sleep(0.001)
+    try:
+        yield
+    finally:
+        release()
+
+
+# Keep the carts in a cache tier shared by every process (Redis, Memcached, a
+# file-based or a database cache) and write them back to the Cart table lazily.
+# The cache entry of a user is the authoritative copy of the cart until it is
+# written back; a cart missing from the cache is loaded from the Cart table.
+# Every change of an entry is made under a lock of the user in the cache, so two
+# processes changing the same cart at once do not lose each other's items.
+# A process writes back the carts it changed on its first cart write after
+# CART_FLUSH_INTERVAL seconds (there is no timer), at checkout and when it
+# exits; manage.py flush_carts writes back every dirty cart, e.g. those of a
+# process which was killed.
+class CachedCartStore:
+    key_prefix = 'cart:'
+
+    def __init__(self):
+        self.cache = caches[get_setting('CART_CACHE_ALIAS')]
+        # Each process would keep its own copy of the carts and overwrite the others
+        if not is_shared_cache(self.cache):
+            raise ImproperlyConfigured(
+                'CachedCartStore needs a CART_CACHE_ALIAS shared by all the processes, not a local memory cache')
+        self.flush_interval = get_setting('CART_FLUSH_INTERVAL')
+        self.last_flush = time.monotonic()
+        # Only one flush at a time in this process
+        self.lock = threading.RLock()
+        # Users whose cart this process changed and has not written back yet
+        self.pending = set()
+        atexit.register(self.flush)
+
+    def _key(self, user_id):
+        return f'{self.key_prefix}{user_id}'
+
+    # Lock the cart of the user in every process
+    def _locked(self, user_id):
+        return cache_lock(self.cache, f'{self._key(user_id)}:lock')
+
+    # Return the cached entry of the user, loading it from the Cart table if missing
+    def _load(self, user_id):
+        entry = self.cache.get(self._key(user_id))
+        if entry is None:
+            rows = Cart.objects.using(shard_for_user(user_id)).filter(user_id=user_id).values(
+                'id', 'menuitem_id', 'quantity', 'unit_price', 'price')
+            entry = {'items': list(rows), 'dirty': False}
+            self.cache.set(self._key(user_id), entry, None)
+        return entry
+
+    def _save(self, user_id, entry):
+        self.cache.set(self._key(user_id), entry, None)
+        bump_on_commit(f'cart:{user_id}', using=shard_for_user(user_id))
+        if entry['dirty']:
+            self.pending.add(user_id)
+
+    def _maybe_flush(self):
+        # Never write back inside a transaction of the caller: if it rolled back,
+        # the carts would already be marked clean in the cache
+        if any(connections[alias].in_atomic_block for alias in get_shards()):
+            return
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    # Return the cart items of the user as (possibly unsaved) Cart instances
+    def get_items(self, user):
+        entry = self._load(user.id)
+        return [Cart(user_id=user.id, **item) for item in entry['items']]
+
+    # Add the menu item to the cart of the user
+    def add_item(self, user, menu_item, quantity):
+        with self._locked(user.id):
+            entry = self._load(user.id)
+            # Same constraint as the unique_together of the Cart table
+            if any(item['menuitem_id'] == menu_item.id for item in entry['items']):
+                raise IntegrityError('UNIQUE constraint failed: menuitem, user')
+            item = {
+                'id': None,
+                'menuitem_id': menu_item.id,
+                'quantity': quantity,
+                'unit_price': menu_item.price,
+                'price': quantity * menu_item.price,
+            }
+            entry['items'].append(item)
+            entry['dirty'] = True
+            self._save(user.id, entry)
+        self._maybe_flush()
+        return Cart(user=user, **item)
+
+    # Delete all items from the cart of the user
+    def clear(self, user):
+        with self._locked(user.id):
+            self._save(user.id, {'items': [], 'dirty': True})
+        self._maybe_flush()
+
+    # Empty the cart in the Cart table within the transaction of the order, and in
+    # the cache once that transaction is committed: a rolled back order keeps its
+    # cart and a cart which has been ordered can not be written back
+    def checkout(self, user):
+        using = shard_for_user(user.id)
+        Cart.objects.using(using).filter(user_id=user.id).delete()
+        transaction.on_commit(lambda: self._empty(user.id), using=using)
+
+    def _empty(self, user_id):
+        with self._locked(user_id):
+            self.cache.set(self._key(user_id), {'items': [], 'dirty': False}, None)
+            self.pending.discard(user_id)
+        bump_on_commit(f'cart:{user_id}', using=shard_for_user(user_id))
+
+    # Reprice the cached carts, which may hold items not written back by any
+    # process yet, then the rows of the Cart table. Return the ids of the users.
+    def reprice(self, prices, chunk_size=500):
+        user_ids = set()
+        all_user_ids = User.objects.values_list('id', flat=True).iterator()
+        while chunk := list(islice(all_user_ids, chunk_size)):
+            entries = self.cache.get_many([self._key(user_id) for user_id in chunk])
+            for user_id in chunk:
+                entry = entries.get(self._key(user_id))
+                if entry is not None and any(item['menuitem_id'] in prices for item in entry['items']):
+                    if self._reprice_entry(user_id, prices):
+                        user_ids.add(user_id)
+        return user_ids | DatabaseCartStore().reprice(prices)
+
+    # Set the new unit prices on the cached cart of the user. A dirty cart stays
+    # dirty and is written back with them, a clean one matches its repriced rows.
+    def _reprice_entry(self, user_id, prices):
+        with self._locked(user_id):
+            entry = self.cache.get(self._key(user_id))
+            items = [item for item in entry['items'] if item['menuitem_id'] in prices] if entry else []
+            for item in items:
+                item['unit_price'] = prices[item['menuitem_id']]
+                item['price'] = item['quantity'] * item['unit_price']
+            if items:
+                self.cache.set(self._key(user_id), entry, None)
+                bump_on_commit(f'cart:{user_id}', using=shard_for_user(user_id))
+        return bool(items)
+
+    # Forget the cached carts of the users (their rows have been purged)
+    def evict(self, user_ids):
+        for user_id in user_ids:
+            with self._locked(user_id):
+                entry = self.cache.get(self._key(user_id))
+                if entry is not None and not entry['dirty']:
+                    self.cache.delete(self._key(user_id))
+
+    # Write the dirty carts of the users (by default those changed by this
+    # process) back to the Cart table, return the number of written carts
+    def flush(self, user_ids=None):
+        flushed = 0
+        with self.lock:
+            for user_id in list(self.pending if user_ids is None else user_ids):
+                self.pending.discard(user_id)
+                entry = self.cache.get(self._key(user_id))
+                if entry is None or not entry['dirty']:
+                    continue
+                using = shard_for_user(user_id)
+                # The cart can not change while its rows are replaced. The lock is
+                # released before the commit, which marks the cart clean under it
+                with transaction.atomic(using=using), self._locked(user_id):
+                    entry = self.cache.get(self._key(user_id))
+                    if entry is None or not entry['dirty']:
+                        continue
+                    Cart.objects.using(using).filter(user_id=user_id).delete()
+                    rows = Cart.objects.using(using).bulk_create(
+                        Cart(user_id=user_id, **{**item, 'id': None}) for item in entry['items'])
+                    transaction.on_commit(
+                        lambda user_id=user_id, entry=entry, rows=rows: self._mark_clean(user_id, entry, rows),
+                        using=using)
+                flushed += 1
+            self.last_flush = time.monotonic()
+        return flushed
+
+    # Mark the written cart clean, unless it has changed meanwhile
+    def _mark_clean(self, user_id, written, rows):
+        def without_ids(items):
+            return [{**item, 'id': None} for item in items]
+
+        with self._locked(user_id):
+            entry = self.cache.get(self._key(user_id))
+            if entry is None or without_ids(entry['items']) != without_ids(written['items']):
+                return
+            for item, row in zip(entry['items'], rows):
+                item['id'] = row.id
+            entry['dirty'] = False
+            self.cache.set(self._key(user_id), entry, None)
+
+
+# Return the cart store configured by LITTLE_LEMON['CART_STORE']
+@lru_cache(maxsize=None)
+def get_cart_store():
+    return import_string(get_setting('CART_STORE'))()
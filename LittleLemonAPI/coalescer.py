@@ -0,0 +1,163 @@
+import logging
+import os
+import queue
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future, TimeoutError
+
+from django.db import connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Write:
+    def __init__(self, using, function, args, kwargs):
+        self.using = using
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+# Group commit of the writes of concurrent requests: the writes submitted within
+# `window` seconds of each other (at most `max_batch` of them) are run by one
+# background thread in a single transaction per database, each in its own
+# savepoint, so a batch costs one commit (and one fsync) instead of one per
+# request. A failing write only rolls back its savepoint and its error is
+# raised in the request which submitted it. A request waits at most `timeout`
+# seconds for its batch.
+class WriteCoalescer:
+    # Number of batches kept for the metrics
+    history = 1000
+    # Seconds between two metrics log lines
+    log_interval = 60
+
+    def __init__(self, window, max_batch, timeout):
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.queue = None
+        self.lock = threading.Lock()
+        self.pid = None
+        self.batch_sizes = deque(maxlen=self.history)
+        self.commit_latencies = deque(maxlen=self.history)
+        self.batches = 0
+        self.writes = 0
+        self.errors = 0
+        self.last_log = time.monotonic()
+
+    # Run function(*args, **kwargs) in the next batch of the database and return its result
+    def submit(self, using, function, *args, **kwargs):
+        # Writes made inside a transaction of the caller belong to that transaction
+        if connections[using].in_atomic_block:
+            return function(*args, **kwargs)
+        self._ensure_worker()
+        write = _Write(using, function, args, kwargs)
+        self.queue.put(write)
+        try:
+            return write.future.result(timeout=self.timeout)
+        except TimeoutError:
+            # The worker skips the write if it has not started it yet
+            write.future.cancel()
+            raise
+
+    # Start the background thread (again in a forked worker, threads do not survive a fork)
+    def _ensure_worker(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.queue = queue.Queue()
+                threading.Thread(target=self._run, args=(self.queue,), name='little-lemon-coalescer',
+                                 daemon=True).start()
+                self.pid = os.getpid()
+
+    def _run(self, writes):
+        while True:
+            batch = [writes.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(writes.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # The thread must survive any error, or every later write would wait forever
+            try:
+                by_database = defaultdict(list)
+                for write in batch:
+                    by_database[write.using].append(write)
+                for using, database_writes in by_database.items():
+                    self.commit(using, database_writes)
+                self._maybe_log()
+            except Exception as e:
+                logger.exception('Coalesced batch of %d writes failed', len(batch))
+                for write in batch:
+                    if not write.future.done():
+                        write.future.set_exception(e)
+
+    # Run the writes in one transaction and resolve their futures once it is committed
+    def commit(self, using, writes):
+        # Skip the writes whose request stopped waiting
+        writes = [write for write in writes if write.future.set_running_or_notify_cancel()]
+        if not writes:
+            return
+        outcomes = []
+        started = time.perf_counter()
+        try:
+            with transaction.atomic(using=using):
+                for write in writes:
+                    try:
+                        with transaction.atomic(using=using):
+                            outcomes.append((write, write.function(*write.args, **write.kwargs), None))
+                    except Exception as e:
+                        outcomes.append((write, None, e))
+        except Exception as e:
+            # The commit failed, none of the writes has been made
+            logger.warning('Coalesced commit of %d writes failed', len(writes), exc_info=True)
+            outcomes = [(write, None, e) for write in writes]
+        finally:
+            # The writes are committed (or rolled back) whatever happens to the connection
+            try:
+                connections[using].close_if_unusable_or_obsolete()
+            except Exception:
+                logger.warning('Closing the connection to %s failed', using, exc_info=True)
+        latency = time.perf_counter() - started
+
+        with self.lock:
+            self.batch_sizes.append(len(writes))
+            self.commit_latencies.append(latency)
+            self.batches += 1
+            self.writes += len(writes)
+            self.errors += sum(1 for write, result, error in outcomes if error is not None)
+        for write, result, error in outcomes:
+            if error is None:
+                write.future.set_result(result)
+            else:
+                write.future.set_exception(error)
+
+    # Return the totals and the metrics of the last batches (latencies in milliseconds)
+    def stats(self):
+        with self.lock:
+            sizes = list(self.batch_sizes)
+            latencies = sorted(latency * 1000 for latency in self.commit_latencies)
+            totals = {'batches': self.batches, 'writes': self.writes, 'errors': self.errors}
+        if not sizes:
+            return totals
+        return {
+            **totals,
+            'batch_size_mean': statistics.fmean(sizes),
+            'batch_size_max': max(sizes),
+            'commit_ms_p50': latencies[len(latencies) // 2],
+            'commit_ms_p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            'commit_ms_max': latencies[-1],
+        }
+
+    def _maybe_log(self):
+        if time.monotonic() - self.last_log >= self.log_interval:
+            self.last_log = time.monotonic()
+            logger.info('Coalesced writes: %s', self.stats())
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+# Defaults of the LITTLE_LEMON settings dictionary
+DEFAULTS = {
+    'CART_STORE': 'LittleLemonAPI.cart_store.DatabaseCartStore',
+    'CART_CACHE_ALIAS': 'default',
+    'CART_FLUSH_INTERVAL': 5,
+    'CART_COALESCE_WINDOW': 0.002,
+    'CART_COALESCE_MAX_BATCH': 100,
+    'CART_COALESCE_TIMEOUT': 10,
+    'CACHE_ALIAS': 'default',
+    'ROLES_TIMEOUT': 300,
+    'CONDITIONAL_GET': True,
+    'MENU_TIMEOUT': 3600,
+    'WARM_UP': False,
+    'PROFILE_DIR': None,
+    'PROFILE_SAMPLE_RATE': 0,
+    'PROFILE_KEEP': 200,
+    'SHARDS': (),
+    'CART_MAX_AGE_DAYS': 7,
+    'TOKEN_MAX_AGE_DAYS': None,
+    'MAINTENANCE_BATCH_SIZE': 500,
+    'MAINTENANCE_PAUSE': 0.05,
+    'BATCH_MAX_REQUESTS': 20,
+    'BATCH_MAX_WORKERS': 4,
+    'MENU_IMPORT_CHUNK_SIZE': 200,
+}
+
+
+# Return the project setting or its default value
+def get_setting(name):
+    return getattr(settings, 'LITTLE_LEMON', {}).get(name, DEFAULTS[name])
+
+
+# Tell whether every process of the project sees the same entries in the cache
+# (a local memory cache only lives in the process which wrote it)
+def is_shared_cache(cache):
+    return not isinstance(cache, (LocMemCache, DummyCache))
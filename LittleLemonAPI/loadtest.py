@@ -0,0 +1,284 @@
+import http.client
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from .roles import MANAGER, DELIVERY_CREW, CUSTOMER
+
+
+# Load test of the API: concurrent client processes replay a mix of customer,
+# delivery crew and manager scenarios against a running server and report the
+# throughput, latency percentiles and error rates per route.
+
+SCENARIOS = ('customer', 'crew', 'manager')
+ROLE_GROUPS = {'customer': CUSTOMER, 'crew': DELIVERY_CREW, 'manager': MANAGER}
+
+
+# Create (or reuse) the load test users of every role, return their tokens and
+# their ids by scenario
+def create_users(per_role):
+    from django.contrib.auth.models import Group, User
+    from rest_framework.authtoken.models import Token
+
+    tokens = {}
+    user_ids = {}
+    for scenario, group_name in ROLE_GROUPS.items():
+        group, created = Group.objects.get_or_create(name=group_name)
+        tokens[scenario] = []
+        user_ids[scenario] = []
+        for i in range(per_role):
+            user, created = User.objects.get_or_create(username=f'loadtest-{scenario}-{i}')
+            if created:
+                user.set_unusable_password()
+                user.save()
+            user.groups.add(group)
+            token, created = Token.objects.get_or_create(user=user)
+            tokens[scenario].append(token.key)
+            user_ids[scenario].append(user.id)
+    return tokens, user_ids
+
+
+# Delete the load test users with their tokens, carts and orders (in every shard)
+def delete_users(user_ids):
+    from django.contrib.auth.models import User
+
+    # The signals delete their rows in the other shards
+    User.objects.filter(id__in=[user_id for ids in user_ids.values() for user_id in ids]).delete()
+
+
+# Copy the SQLite databases of the project into the directory and point the
+# connections of this process at the copies, return the path of every copy
+def copy_databases(directory):
+    from django.db import connections
+
+    copies = {}
+    for alias in connections:
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            raise RuntimeError(f'The database {alias} is not SQLite, test a running server with --url')
+        connection.close()
+        copy = str(Path(directory) / f'{alias}.sqlite3')
+        # The backup API copies a consistent snapshot even while the project is running
+        source, target = sqlite3.connect(connection.settings_dict['NAME']), sqlite3.connect(copy)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        connection.settings_dict['NAME'] = copy
+        copies[alias] = copy
+    return copies
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Start the project locally behind the WSGI (runserver) or ASGI (uvicorn) server,
+# without throttling and on the copies of the databases
+def start_server(interface, manage_py, databases):
+    port = _free_port()
+    if interface == 'wsgi':
+        command = [sys.executable, manage_py, 'runserver', '--noreload', f'127.0.0.1:{port}']
+    elif interface == 'asgi':
+        if importlib.util.find_spec('uvicorn') is None:
+            raise RuntimeError('The ASGI load test needs uvicorn to be installed')
+        command = [sys.executable, '-m', 'uvicorn', 'LittleLemon.asgi:application',
+                   '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    else:
+        raise ValueError(f'Unknown interface {interface}')
+    env = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': 'LittleLemon.settings_loadtest',
+        'LITTLE_LEMON_LOADTEST_DATABASES': json.dumps(databases),
+    }
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+
+    # Wait until the server accepts connections
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'The {interface} server exited with code {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'The {interface} server did not start in time')
+
+
+# HTTP client of one simulated user, recording every call
+class Client:
+    def __init__(self, base_url, token, samples, user_ids):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        self.headers = {'Authorization': f'Token {token}', 'Accept': 'application/json'}
+        self.samples = samples
+        # The ids of the load test users by scenario: the scenarios only change the
+        # orders of the load test customers
+        self.user_ids = user_ids
+        self.etags = {}
+
+    def request(self, method, path, route, body=None, conditional=False):
+        headers = dict(self.headers)
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if conditional and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            payload, status = b'', 0
+        self.samples[f'{method} {route}'].append((status, time.perf_counter() - started))
+        if status == 200 and conditional and response.getheader('ETag'):
+            self.etags[path] = response.getheader('ETag')
+        try:
+            return status, json.loads(payload) if payload else None
+        except ValueError:
+            return status, None
+
+
+def _results(data):
+    if isinstance(data, dict):
+        return data.get('results', [])
+    return data or []
+
+
+# Browse the menu, fill the cart, check out and poll the orders
+def customer_scenario(client, rng, polls):
+    status, menu = client.request('GET', '/api/menu-items', '/api/menu-items')
+    client.request('GET', '/api/category', '/api/category')
+    items = _results(menu)
+    for item in rng.sample(items, min(len(items), rng.randint(1, 3))):
+        client.request('POST', '/api/cart/menu-items', '/api/cart/menu-items',
+                       {'food_id': item['id'], 'food_quantity': rng.randint(1, 3)})
+    client.request('GET', '/api/cart/menu-items', '/api/cart/menu-items', conditional=True)
+    client.request('POST', '/api/orders', '/api/orders')
+    for i in range(polls):
+        client.request('GET', '/api/orders', '/api/orders', conditional=True)
+
+
+# Poll the assigned orders and mark one of them as delivered
+def crew_scenario(client, rng, polls):
+    orders = []
+    for i in range(polls):
+        status, data = client.request('GET', '/api/orders', '/api/orders', conditional=True)
+        orders = _results(data) or orders
+    if orders:
+        order = rng.choice(orders)
+        client.request('PATCH', f'/api/orders/{order["id"]}', '/api/orders/<id>', {'status': 1})
+
+
+# List the orders and the menu, then reopen an order of a load test customer and
+# assign it to a load test delivery crew (whose scenario then finds orders)
+def manager_scenario(client, rng, polls):
+    # Newest first: the orders of the load test customers
+    status, data = client.request('GET', '/api/orders?ordering=-id', '/api/orders', conditional=True)
+    client.request('GET', '/api/menu-items?ordering=price', '/api/menu-items')
+    orders = [order for order in _results(data) if order.get('user') in client.user_ids.get('customer', ())]
+    if orders:
+        order = rng.choice(orders)
+        client.request('GET', '/api/orders?page=2', '/api/orders', conditional=True)
+        changes = {'status': 0}
+        if client.user_ids.get('crew'):
+            changes['delivery_crew'] = rng.choice(client.user_ids['crew'])
+        client.request('PATCH', f'/api/orders/{order["id"]}', '/api/orders/<id>', changes)
+
+
+SCENARIO_FUNCTIONS = {
+    'customer': customer_scenario,
+    'crew': crew_scenario,
+    'manager': manager_scenario,
+}
+
+
+# Body of a client process: run weighted random scenarios until the deadline
+def run_client(base_url, tokens, user_ids, mix, duration, think_time, polls, seed, results):
+    rng = random.Random(seed)
+    samples = defaultdict(list)
+    clients = {}
+    scenarios = [scenario for scenario in mix if tokens.get(scenario)]
+    weights = [mix[scenario] for scenario in scenarios]
+    deadline = time.monotonic() + duration
+    while scenarios and time.monotonic() < deadline:
+        scenario = rng.choices(scenarios, weights)[0]
+        if scenario not in clients:
+            clients[scenario] = Client(base_url, rng.choice(tokens[scenario]), samples, user_ids)
+        SCENARIO_FUNCTIONS[scenario](clients[scenario], rng, polls)
+        if think_time:
+            time.sleep(rng.uniform(0, 2 * think_time))
+    results.put(dict(samples))
+
+
+# Nearest-rank percentile of sorted values
+def percentile(values, rank):
+    if not values:
+        return None
+    return values[max(0, min(len(values) - 1, round(rank / 100 * len(values)) - 1))]
+
+
+# Merge the samples of all the clients into the per route report
+def summarize(all_samples, elapsed):
+    merged = defaultdict(list)
+    for samples in all_samples:
+        for route, calls in samples.items():
+            merged[route].extend(calls)
+    routes = {}
+    for route, calls in sorted(merged.items()):
+        latencies = sorted(latency for status, latency in calls)
+        statuses = defaultdict(int)
+        for status, latency in calls:
+            statuses[str(status)] += 1
+        errors = sum(count for status, count in statuses.items() if status == '0' or int(status) >= 500)
+        rejected = sum(count for status, count in statuses.items() if 400 <= int(status) < 500)
+        routes[route] = {
+            'requests': len(calls),
+            'throughput': len(calls) / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'error_rate': errors / len(calls),
+            'client_error_rate': rejected / len(calls),
+            'statuses': dict(statuses),
+        }
+    total = sum(route['requests'] for route in routes.values())
+    return {'elapsed': elapsed, 'requests': total, 'throughput': total / elapsed, 'routes': routes}
+
+
+# Spawn the client processes and return the report
+def run(base_url, tokens, user_ids, mix, clients, duration, think_time=0, polls=3, seed=None):
+    seed = random.randrange(2 ** 32) if seed is None else seed
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_client, args=(
+            base_url, tokens, user_ids, mix, duration, think_time, polls, seed + i, results))
+        for i in range(clients)
+    ]
+    started = time.monotonic()
+    for process in processes:
+        process.start()
+    all_samples = [results.get(timeout=duration + 120) for process in processes]
+    for process in processes:
+        process.join()
+    return summarize(all_samples, time.monotonic() - started)
@@ -0,0 +1,197 @@
+import logging
+import pickle
+import threading
+import time
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cart_store import get_cart_store
+from .conf import get_setting
+from .models import Cart
+from .sharding import get_shards
+
+
+logger = logging.getLogger(__name__)
+
+
+# Housekeeping of the database: purge abandoned carts, stale tokens and expired
+# cache entries in small batches with short transactions (so the SQLite writer
+# lock is never held for long), then refresh the planner statistics and
+# optionally reclaim the free pages of every SQLite database.
+class MaintenanceEngine:
+    tasks = ('carts', 'tokens', 'cache', 'databases')
+
+    def __init__(self, cart_max_age=None, token_max_age=None, batch_size=None, pause=None,
+                 vacuum=False, dry_run=False):
+        self.cart_max_age = cart_max_age if cart_max_age is not None else get_setting('CART_MAX_AGE_DAYS')
+        self.token_max_age = token_max_age if token_max_age is not None else get_setting('TOKEN_MAX_AGE_DAYS')
+        self.batch_size = batch_size or get_setting('MAINTENANCE_BATCH_SIZE')
+        self.pause = pause if pause is not None else get_setting('MAINTENANCE_PAUSE')
+        self.vacuum = vacuum
+        self.dry_run = dry_run
+
+    # Delete the rows of the queryset in batches, return the number of deleted rows
+    def delete_in_batches(self, queryset, on_batch=None):
+        if self.dry_run:
+            return queryset.count()
+        using = queryset.db
+        deleted = 0
+        while True:
+            ids = list(queryset.values_list('pk', flat=True)[:self.batch_size])
+            if not ids:
+                return deleted
+            with transaction.atomic(using=using):
+                # Filtered again: a row may no longer match once the batch is locked
+                batch = queryset.filter(pk__in=ids)
+                if on_batch:
+                    on_batch(batch)
+                batch.delete()
+            deleted += len(ids)
+            # Let the waiting writers in
+            time.sleep(self.pause)
+
+    # Delete the carts nobody has touched for CART_MAX_AGE_DAYS: a cart is the set of
+    # rows of a user, it is kept whole as long as one of its items is recent
+    def purge_carts(self):
+        if not self.cart_max_age:
+            return 0
+        cutoff = timezone.now() - timedelta(days=self.cart_max_age)
+        cart_store = get_cart_store()
+        evict = getattr(cart_store, 'evict', None)
+
+        def forget_cached_carts(batch):
+            if evict:
+                evict(set(batch.values_list('user_id', flat=True)))
+
+        deleted = 0
+        for shard in get_shards():
+            carts = Cart.objects.using(shard)
+            active_users = carts.filter(updated__gte=cutoff).values('user_id')
+            deleted += self.delete_in_batches(carts.exclude(user_id__in=active_users), forget_cached_carts)
+        return deleted
+
+    # Delete the tokens of inactive users and the tokens older than TOKEN_MAX_AGE_DAYS
+    def purge_tokens(self):
+        from rest_framework.authtoken.models import Token
+
+        stale = Q(user__is_active=False)
+        if self.token_max_age:
+            stale |= Q(created__lt=timezone.now() - timedelta(days=self.token_max_age))
+        return self.delete_in_batches(Token.objects.filter(stale))
+
+    # Delete the expired entries (e.g. throttle histories) of the file and database
+    # caches, which Django only drops when they are read again or culled. There is
+    # no public API to list the entries, so this relies on the storage of the
+    # backends (FileBasedCache._list_cache_files and _delete, DatabaseCache._table).
+    # Local memory caches are skipped: they live in the memory of each process, the
+    # command would only see its own empty one.
+    def purge_cache(self):
+        purged = 0
+        for cache in caches.all():
+            if isinstance(cache, FileBasedCache):
+                for path in cache._list_cache_files():
+                    # Every cache file starts with its pickled expiry time
+                    try:
+                        with open(path, 'rb') as file:
+                            expiry = pickle.load(file)
+                    except (OSError, EOFError, pickle.UnpicklingError):
+                        continue
+                    if expiry is not None and expiry < time.time():
+                        if not self.dry_run:
+                            cache._delete(path)
+                        purged += 1
+            elif isinstance(cache, DatabaseCache):
+                purged += self.purge_database_cache(cache)
+        return purged
+
+    def purge_database_cache(self, cache):
+        using = router.db_for_write(cache.cache_model_class)
+        connection = connections[using]
+        table = connection.ops.quote_name(cache._table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now().replace(microsecond=0))
+        purged = 0
+        while True:
+            with transaction.atomic(using=using), connection.cursor() as cursor:
+                if self.dry_run:
+                    cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE expires < %s', [now])
+                    return cursor.fetchone()[0]
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE cache_key IN '
+                    f'(SELECT cache_key FROM {table} WHERE expires < %s LIMIT %s)',
+                    [now, self.batch_size])
+                deleted = cursor.rowcount
+            purged += deleted
+            if deleted < self.batch_size:
+                return purged
+            time.sleep(self.pause)
+
+    # Refresh the planner statistics of every SQLite database and reclaim free pages
+    def optimize_databases(self):
+        report = {}
+        for alias in dict.fromkeys(('default',) + get_shards()):
+            connection = connections[alias]
+            if connection.vendor != 'sqlite':
+                continue
+            with connection.cursor() as cursor:
+                if not self.dry_run:
+                    cursor.execute('ANALYZE')
+                    cursor.execute('PRAGMA optimize')
+                size_before = self.database_size(cursor)
+                if self.vacuum and not self.dry_run:
+                    cursor.execute('VACUUM')
+                size_after = self.database_size(cursor)
+                cursor.execute('PRAGMA freelist_count')
+                free_pages = cursor.fetchone()[0]
+            report[alias] = {
+                'size': size_after,
+                'reclaimed': size_before - size_after,
+                'free_pages': free_pages,
+            }
+        return report
+
+    @staticmethod
+    def database_size(cursor):
+        cursor.execute('PRAGMA page_count')
+        page_count = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        return page_count * cursor.fetchone()[0]
+
+    # Run the tasks once and return their results
+    def run(self, tasks=None):
+        functions = {
+            'carts': self.purge_carts,
+            'tokens': self.purge_tokens,
+            'cache': self.purge_cache,
+            'databases': self.optimize_databases,
+        }
+        report = {}
+        for task in tasks or self.tasks:
+            started = time.perf_counter()
+            report[task] = {'result': functions[task](), 'duration': time.perf_counter() - started}
+            logger.info('Maintenance task %s: %s', task, report[task])
+        return report
+
+    # Run the tasks every `interval` seconds
+    def run_forever(self, interval, tasks=None, on_report=None):
+        while True:
+            started = time.monotonic()
+            try:
+                report = self.run(tasks)
+                if on_report:
+                    on_report(report)
+            except Exception:
+                logger.exception('Maintenance failed')
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+
+    # Run the tasks every `interval` seconds in a background thread of this process
+    def start(self, interval, tasks=None):
+        thread = threading.Thread(target=self.run_forever, args=(interval, tasks),
+                                  name='little-lemon-maintenance', daemon=True)
+        thread.start()
+        return thread
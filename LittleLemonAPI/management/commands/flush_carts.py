@@ -0,0 +1,17 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.cart_store import get_cart_store
+
+
+class Command(BaseCommand):
+    help = 'Write the carts kept by the cached cart store back to the Cart table'
+
+    def handle(self, *args, **options):
+        cart_store = get_cart_store()
+        if not hasattr(cart_store, 'flush'):
+            self.stdout.write('The configured cart store writes to the Cart table directly')
+            return
+        # The dirty carts of every process, not only those changed by this one
+        flushed = cart_store.flush(User.objects.values_list('id', flat=True).iterator())
+        self.stdout.write(self.style.SUCCESS(f'{flushed} cart(s) written to the Cart table'))
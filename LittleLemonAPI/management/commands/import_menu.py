@@ -0,0 +1,41 @@
+import json
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI.menu_import import EXTENSIONS, MenuImporter, format_for_path, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Create and update menu items from a CSV or NDJSON file (id, title, price, featured, category) '
+            'and reprice the carts holding the menu items whose price changed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Menu file, - for the standard input')
+        parser.add_argument('--format', choices=sorted(set(EXTENSIONS.values())),
+                            help='Format of the file (guessed from its extension by default)')
+        parser.add_argument('--chunk-size', type=int, help='Rows validated and written per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the file and count the changes')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or format_for_path(path)
+        if file_format is None:
+            raise CommandError('Unknown file format, use --format')
+        importer = MenuImporter(chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        try:
+            stream = nullcontext(sys.stdin.buffer) if path == '-' else open(path, 'rb')
+        except OSError as e:
+            raise CommandError(e)
+        with stream as file:
+            report = importer.run(read_rows(file, file_format))
+
+        for error in report['errors']:
+            self.stderr.write(f'row {error["row"]}: {json.dumps(error["errors"])}')
+        if report['invalid'] > len(report['errors']):
+            self.stderr.write(f'... {report["invalid"] - len(report["errors"])} more invalid rows')
+        self.stdout.write(self.style.SUCCESS(
+            f'{report["created"]} created, {report["updated"]} updated, {report["unchanged"]} unchanged, '
+            f'{report["invalid"]} invalid, {report["carts_repriced"]} carts repriced'
+            + (' (dry run)' if options['dry_run'] else '')))
@@ -0,0 +1,97 @@
+import json
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from LittleLemonAPI import loadtest
+
+
+class Command(BaseCommand):
+    help = ('Replay a mix of customer, delivery crew and manager scenarios with concurrent '
+            'client processes and report throughput, latency percentiles and error rates per route. '
+            'The server started by the command runs on copies of the databases without throttling; '
+            'with --url the throttle rates of the tested server apply and the load test users '
+            'are deleted after the run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interface', choices=['wsgi', 'asgi'], default='wsgi',
+                            help='Start the project behind runserver (wsgi) or uvicorn (asgi)')
+        parser.add_argument('--url', help='Test an already running server instead of starting one')
+        parser.add_argument('--clients', type=int, default=4, help='Number of client processes')
+        parser.add_argument('--duration', type=float, default=30, help='Duration of the test in seconds')
+        parser.add_argument('--mix', default='customer=8,crew=1,manager=1',
+                            help='Weights of the scenarios, e.g. customer=8,crew=1,manager=1')
+        parser.add_argument('--users', type=int, default=5, help='Load test users created per role')
+        parser.add_argument('--polls', type=int, default=3, help='Order list polls per scenario')
+        parser.add_argument('--think-time', type=float, default=0,
+                            help='Mean pause between two scenarios of a client in seconds')
+        parser.add_argument('--seed', type=int, help='Seed of the random scenario choice')
+        parser.add_argument('--output', help='Write the report as JSON to this file')
+
+    def parse_mix(self, value):
+        mix = {}
+        for part in value.split(','):
+            name, _, weight = part.partition('=')
+            if name not in loadtest.SCENARIOS:
+                raise CommandError(f'Unknown scenario {name}, choose from {", ".join(loadtest.SCENARIOS)}')
+            try:
+                mix[name] = float(weight or 1)
+            except ValueError:
+                raise CommandError(f'The weight of {name} is not a number')
+        return mix
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+        with tempfile.TemporaryDirectory(prefix='loadtest-') as directory:
+            if not options['url']:
+                # The started server runs on copies, the project databases are never written
+                try:
+                    databases = loadtest.copy_databases(directory)
+                except RuntimeError as e:
+                    raise CommandError(e)
+                for alias in databases:
+                    call_command('migrate', database=alias, verbosity=0)
+            tokens, user_ids = loadtest.create_users(options['users'])
+
+            server = None
+            base_url = options['url']
+            try:
+                if not base_url:
+                    try:
+                        server, base_url = loadtest.start_server(
+                            options['interface'], str(Path(settings.BASE_DIR) / 'manage.py'), databases)
+                    except RuntimeError as e:
+                        raise CommandError(e)
+                self.stdout.write(f'Load testing {base_url} with {options["clients"]} clients '
+                                  f'for {options["duration"]:g}s')
+                report = loadtest.run(base_url, tokens, user_ids, mix, options['clients'], options['duration'],
+                                      options['think_time'], options['polls'], options['seed'])
+            finally:
+                if server:
+                    server.terminate()
+                    server.wait()
+                if options['url']:
+                    loadtest.delete_users(user_ids)
+                connections.close_all()
+
+        report['interface'] = None if options['url'] else options['interface']
+        report['clients'] = options['clients']
+        report['mix'] = mix
+
+        self.stdout.write(f'{"route":<32}{"req":>7}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}'
+                          f'{"p99 ms":>9}{"err %":>8}{"4xx %":>8}')
+        for route, stats in report['routes'].items():
+            self.stdout.write(
+                f'{route:<32}{stats["requests"]:>7}{stats["throughput"]:>9.1f}{stats["p50_ms"]:>9.1f}'
+                f'{stats["p95_ms"]:>9.1f}{stats["p99_ms"]:>9.1f}{stats["error_rate"] * 100:>8.1f}'
+                f'{stats["client_error_rate"] * 100:>8.1f}')
+        self.stdout.write(f'Total: {report["requests"]} requests, {report["throughput"]:.1f} req/s')
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Report written to {options["output"]}'))
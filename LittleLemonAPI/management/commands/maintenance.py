@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.maintenance import MaintenanceEngine
+
+
+class Command(BaseCommand):
+    help = ('Purge abandoned carts, stale tokens and expired cache entries in small batches, '
+            'refresh the planner statistics and optionally vacuum the SQLite databases')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', nargs='+', choices=MaintenanceEngine.tasks,
+                            help='Tasks to run (all by default)')
+        parser.add_argument('--cart-max-age', type=int, help='Age in days of the carts to delete')
+        parser.add_argument('--token-max-age', type=int, help='Age in days of the tokens to delete')
+        parser.add_argument('--batch-size', type=int, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, help='Seconds to wait between two batches')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='Rebuild the databases to reclaim free pages (locks each database meanwhile)')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted')
+        parser.add_argument('--every', type=float,
+                            help='Keep running and repeat the tasks every EVERY seconds')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        engine = MaintenanceEngine(
+            cart_max_age=options['cart_max_age'],
+            token_max_age=options['token_max_age'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            vacuum=options['vacuum'],
+            dry_run=options['dry_run'],
+        )
+        if options['every']:
+            engine.run_forever(options['every'], options['tasks'], self.write_report)
+        else:
+            self.write_report(engine.run(options['tasks']))
+
+    def write_report(self, report):
+        verb = 'would be deleted' if self.dry_run else 'deleted'
+        for task, outcome in report.items():
+            result = outcome['result']
+            if task == 'databases':
+                for alias, stats in result.items():
+                    self.stdout.write(
+                        f'database {alias}: {stats["size"] / 1024:.0f} KiB, '
+                        f'{stats["reclaimed"] / 1024:.0f} KiB reclaimed, {stats["free_pages"]} free pages')
+            else:
+                self.stdout.write(f'{task}: {result} {verb}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Maintenance done in {sum(outcome["duration"] for outcome in report.values()):.2f}s'))
@@ -0,0 +1,55 @@
+import io
+import pstats
+import shutil
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI.profiling import get_profile_dir, list_profiles
+
+
+class Command(BaseCommand):
+    help = 'List the stored request profiles, or summarize one of them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', help='Summarize this profile')
+        parser.add_argument('--top', type=int, default=20, help='Number of functions and queries to show')
+        parser.add_argument('--sort', default='cumulative', help='pstats sort key of the functions')
+        parser.add_argument('--clear', action='store_true', help='Delete all the stored profiles')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            shutil.rmtree(get_profile_dir(), ignore_errors=True)
+            self.stdout.write(self.style.SUCCESS('All profiles deleted'))
+        elif options['profile_id']:
+            self.summarize(options['profile_id'], options['top'], options['sort'])
+        else:
+            self.list()
+
+    def list(self):
+        self.stdout.write(f'{"id":<35}{"time":<21}{"status":>7}{"ms":>9}{"sql":>5}{"sql ms":>9}  request')
+        for profile in list_profiles():
+            started = datetime.fromtimestamp(profile['time']).strftime('%Y-%m-%d %H:%M:%S')
+            self.stdout.write(
+                f'{profile["id"]:<35}{started:<21}{profile["status"]:>7}{profile["duration_ms"]:>9.1f}'
+                f'{len(profile["queries"]):>5}{profile["sql_ms"]:>9.1f}  '
+                f'{profile["method"]} {profile["path"]} ({profile["user"]}, {profile["trigger"]})')
+
+    def summarize(self, profile_id, top, sort):
+        profile = next((p for p in list_profiles() if p['id'] == profile_id), None)
+        if profile is None:
+            raise CommandError(f'The profile {profile_id} does not exist')
+        self.stdout.write(f'{profile["method"]} {profile["path"]} -> {profile["status"]} '
+                          f'in {profile["duration_ms"]:.1f} ms, {len(profile["queries"])} queries '
+                          f'in {profile["sql_ms"]:.1f} ms')
+
+        self.stdout.write('\nSlowest queries')
+        for query in sorted(profile['queries'], key=lambda q: q['duration_ms'], reverse=True)[:top]:
+            self.stdout.write(f'{query["duration_ms"]:>9.2f} ms  [{query["alias"]}] {query["sql"]}')
+
+        self.stdout.write('\nFunctions')
+        # OutputWrapper ends every write with a new line, so render the report first
+        report = io.StringIO()
+        stats = pstats.Stats(str(get_profile_dir() / f'{profile_id}.prof'), stream=report)
+        stats.strip_dirs().sort_stats(sort).print_stats(top)
+        self.stdout.write(report.getvalue())
@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI.warmup import warm_up
+
+
+# Import the WSGI application the way a fresh worker does
+BOOT_CODE = 'import LittleLemon.wsgi'
+
+
+class Command(BaseCommand):
+    help = ('Measure the boot of a fresh worker: the import time of every module '
+            '(python -X importtime) and the duration of every warm-up step')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='Number of modules to report')
+        parser.add_argument('--sort', choices=['cumulative', 'self'], default='cumulative',
+                            help='Sort the modules by cumulative or self import time')
+
+    # Return (module, self us, cumulative us) for every import of a fresh interpreter
+    def measure_imports(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'LittleLemon.settings'))
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', BOOT_CODE],
+                                capture_output=True, text=True, env=env)
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            try:
+                own, cumulative, module = line[len('import time:'):].split('|')
+                imports.append((module.strip(), int(own), int(cumulative)))
+            except ValueError:
+                # Header line
+                continue
+        return imports
+
+    def handle(self, *args, **options):
+        imports = self.measure_imports()
+        total = sum(own for module, own, cumulative in imports)
+        index = 2 if options['sort'] == 'cumulative' else 1
+        self.stdout.write(f'{"module":<60}{"self ms":>10}{"cumul. ms":>12}')
+        for module, own, cumulative in sorted(imports, key=lambda i: i[index], reverse=True)[:options['top']]:
+            self.stdout.write(f'{module:<60}{own / 1000:>10.1f}{cumulative / 1000:>12.1f}')
+        self.stdout.write(f'{len(imports)} modules imported in {total / 1000:.1f} ms')
+
+        self.stdout.write('')
+        self.stdout.write(f'{"warm-up step":<60}{"ms":>10}')
+        timings = warm_up()
+        for name, duration in timings.items():
+            self.stdout.write(f'{name:<60}{duration * 1000:>10.1f}')
+        self.stdout.write(f'Warm-up done in {sum(timings.values()) * 1000:.1f} ms')
@@ -0,0 +1,26 @@
+from django.core.cache import caches
+
+from .conf import get_setting, is_shared_cache
+from .models import MenuItem
+from .versions import get_versions
+
+
+# Return the cache of the menu, None when it is local to the process: the
+# version bumped by a worker changing a price would not reach the others,
+# which would keep selling at the old price for up to MENU_TIMEOUT
+def _get_cache():
+    cache = caches[get_setting('CACHE_ALIAS')]
+    return cache if is_shared_cache(cache) else None
+
+
+# Return the whole menu (id -> MenuItem), cached until a menu item changes
+def get_menu():
+    cache = _get_cache()
+    if cache is None:
+        return {item.id: item for item in MenuItem.objects.all()}
+    key = f'menu:{get_versions("menu")["menu"]}'
+    menu = cache.get(key)
+    if menu is None:
+        menu = {item.id: item for item in MenuItem.objects.all()}
+        cache.set(key, menu, get_setting('MENU_TIMEOUT'))
+    return menu
@@ -0,0 +1,163 @@
+import codecs
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from .cart_store import get_cart_store
+from .conf import get_setting
+from .models import Category, MenuItem
+from .serializers import MenuImportSerializer
+from .versions import bump_on_commit
+
+
+# Menu files have one menu item per row with the columns (or keys) id, title,
+# price, featured and category (the slug of the category). A row with an id
+# updates that menu item, a row without an id updates the menu item with the
+# same title or creates it. A missing featured value keeps the current one
+# (False for a new menu item).
+
+CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+UPDATED_FIELDS = ('title', 'price', 'featured', 'category_id')
+# Errors listed in the report (all of them are counted)
+MAX_ERRORS = 100
+
+
+# Return the format of a request body ('csv', 'ndjson' or None)
+def format_for_content_type(content_type):
+    return CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+
+
+# Return the format of a file ('csv', 'ndjson' or None)
+def format_for_path(path):
+    for extension, file_format in EXTENSIONS.items():
+        if str(path).lower().endswith(extension):
+            return file_format
+    return None
+
+
+def read_csv(lines):
+    for row in csv.DictReader(lines):
+        # Empty cells are missing values
+        yield {key.strip(): value.strip() for key, value in row.items()
+               if key and isinstance(value, str) and value.strip()}
+
+
+def read_ndjson(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Reported by the validation of the row
+                yield line
+
+
+# Yield the rows of a binary stream (a file or the request) line by line
+def read_rows(stream, file_format):
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    return read_csv(lines) if file_format == 'csv' else read_ndjson(lines)
+
+
+# Create and update the menu items of a menu file MENU_IMPORT_CHUNK_SIZE rows at
+# a time: every chunk is validated, matched to the existing menu items with one
+# query and written with bulk_create/bulk_update in one transaction. The carts
+# holding a menu item whose price changed are repriced after every chunk.
+class MenuImporter:
+
+    def __init__(self, chunk_size=None, dry_run=False):
+        self.chunk_size = chunk_size or get_setting('MENU_IMPORT_CHUNK_SIZE')
+        self.dry_run = dry_run
+        self.serializer = MenuImportSerializer()
+
+    # Import the rows and return the report of the import
+    def run(self, rows):
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.report = {
+            'created': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'invalid': 0,
+            'carts_repriced': 0,
+            'errors': [],
+        }
+        numbered_rows = enumerate(rows, start=1)
+        while chunk := list(islice(numbered_rows, self.chunk_size)):
+            self.import_chunk(chunk)
+        return self.report
+
+    def add_error(self, row_number, errors):
+        self.report['invalid'] += 1
+        if len(self.report['errors']) < MAX_ERRORS:
+            self.report['errors'].append({'row': row_number, 'errors': errors})
+
+    # Return the validated rows of the chunk with the id of their category
+    def validate(self, chunk):
+        valid = []
+        for row_number, row in chunk:
+            try:
+                data = self.serializer.run_validation(row)
+            except ValidationError as e:
+                self.add_error(row_number, e.detail)
+                continue
+            data['category_id'] = self.categories.get(data.pop('category'))
+            if data['category_id'] is None:
+                self.add_error(row_number, {'category': ['Unknown category']})
+                continue
+            valid.append((row_number, data))
+        return valid
+
+    def import_chunk(self, chunk):
+        valid = self.validate(chunk)
+        ids = {data['id'] for row_number, data in valid if 'id' in data}
+        titles = {data['title'] for row_number, data in valid if 'id' not in data}
+        by_id = {item.id: item for item in MenuItem.objects.filter(Q(id__in=ids) | Q(title__in=titles))}
+        by_title = {}
+        for item_id in sorted(by_id):
+            by_title.setdefault(by_id[item_id].title, by_id[item_id])
+
+        created, updated, prices = [], {}, {}
+        for row_number, data in valid:
+            if 'id' in data:
+                item = by_id.get(data.pop('id'))
+                if item is None:
+                    self.add_error(row_number, {'id': ['Unknown menu item']})
+                    continue
+            else:
+                item = by_title.get(data['title'])
+                if item is None:
+                    item = MenuItem(**{'featured': False, **data})
+                    # Later rows with the same title update the new menu item
+                    by_title[item.title] = item
+                    created.append(item)
+                    continue
+            if all(getattr(item, field) == value for field, value in data.items()):
+                self.report['unchanged'] += 1
+                continue
+            if item.pk is not None and item.price != data['price']:
+                prices[item.pk] = data['price']
+            for field, value in data.items():
+                setattr(item, field, value)
+            if item.pk is not None:
+                updated[item.pk] = item
+
+        self.report['created'] += len(created)
+        self.report['updated'] += len(updated)
+        if self.dry_run or not (created or updated):
+            return
+        with transaction.atomic():
+            MenuItem.objects.bulk_create(created)
+            MenuItem.objects.bulk_update(updated.values(), UPDATED_FIELDS)
+            # bulk_create and bulk_update send no signals
+            bump_on_commit('menu')
+        if prices:
+            self.report['carts_repriced'] += len(get_cart_store().reprice(prices))
@@ -22,12 +22,15 @@ class MenuItem(models.Model):
         return self.title
     
     
+# Cart, Order and OrderItem rows may live in a shard database (see sharding.py),
+# so their references to users and menu items are not database constraints
 class Cart(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_constraint=False)
     quantity = models.PositiveSmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     price = models.DecimalField(max_digits=6, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
+    updated = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return str(self.id) + '_' + self.user.username
@@ -37,25 +40,35 @@ class Cart(models.Model):
         
         
 class Order(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='delivery_crew', null=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='delivery_crew', null=True,
+                                      db_constraint=False)
     status = models.BooleanField(db_index=True, default=0)
     total = models.DecimalField(max_digits=6, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     date = models.DateField(db_index=True, auto_now_add=True)
     
     def __str__(self):
-        return self.id
+        return str(self.id)
     
     
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
-    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_constraint=False)
     quantity = models.PositiveSmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     price = models.DecimalField(max_digits=6, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     
     def __str__(self):
-        return self.id
+        return str(self.id)
     
     class Meta:
-        unique_together = ('order', 'menuitem')
\ No newline at end of file
+        unique_together = ('order', 'menuitem')
+        
+        
+# Last order id handed out in the database of a shard (see sharding.save_order)
+class Sequence(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    last_value = models.BigIntegerField()
+    
+    def __str__(self):
+        return self.name
\ No newline at end of file
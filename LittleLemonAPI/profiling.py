@@ -0,0 +1,135 @@
+import cProfile
+import json
+import random
+import time
+import uuid
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .conf import get_setting
+
+
+# Return the directory of the stored profiles
+def get_profile_dir():
+    return Path(get_setting('PROFILE_DIR') or Path(settings.BASE_DIR) / 'profiles')
+
+
+# Return the metadata of the stored profiles, newest first
+def list_profiles():
+    profiles = []
+    for path in sorted(get_profile_dir().glob('*.json'), reverse=True):
+        with open(path) as file:
+            profiles.append(json.load(file))
+    return profiles
+
+
+# Return whether the value of a flag (X-Profile, ?profile=) turns it on
+def is_enabled(value):
+    return value.strip().lower() in ('1', 'true', 'yes')
+
+
+# Record the SQL statements run while profiling
+class QueryLog:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+            })
+
+
+# Profile the whole request (authentication, throttles, permissions, queryset and
+# rendering) when a staff user asks for it with X-Profile: 1 or ?profile=1 (or true),
+# and a random sample of all requests at LITTLE_LEMON['PROFILE_SAMPLE_RATE'].
+# The profile and the SQL log go to LITTLE_LEMON['PROFILE_DIR'], which keeps the
+# last LITTLE_LEMON['PROFILE_KEEP'] profiles.
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trigger = self.get_trigger(request)
+        if not trigger:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        query_log = QueryLog()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_log))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - started
+
+        profile_id = self.store(request, response, trigger, profiler, query_log, duration)
+        response['X-Profile-Id'] = profile_id
+        return response
+
+    # Return why the request is profiled ('requested', 'sampled' or None)
+    def get_trigger(self, request):
+        if is_enabled(request.META.get('HTTP_X_PROFILE', '')) or is_enabled(request.GET.get('profile', '')):
+            if self.is_staff(request):
+                return 'requested'
+        sample_rate = get_setting('PROFILE_SAMPLE_RATE')
+        if sample_rate and random.random() < sample_rate:
+            return 'sampled'
+        return None
+
+    # Check the session user, or the token user since token authentication only runs in DRF
+    def is_staff(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.is_staff
+        header = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(header) != 2 or header[0].lower() != 'token':
+            return False
+        try:
+            user, token = TokenAuthentication().authenticate_credentials(header[1])
+        except AuthenticationFailed:
+            return False
+        return user.is_staff
+
+    def store(self, request, response, trigger, profiler, query_log, duration):
+        profile_dir = get_profile_dir()
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        # Sorted by time, down to the microsecond for the rotation
+        profile_id = f'{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}-{uuid.uuid4().hex[:8]}'
+        profiler.dump_stats(profile_dir / f'{profile_id}.prof')
+        user = getattr(request, 'user', None)
+        meta = {
+            'id': profile_id,
+            'time': time.time(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'user': user.username if user is not None and user.is_authenticated else None,
+            'trigger': trigger,
+            'duration_ms': duration * 1000,
+            'sql_ms': sum(query['duration_ms'] for query in query_log.queries),
+            'queries': query_log.queries,
+        }
+        with open(profile_dir / f'{profile_id}.json', 'w') as file:
+            json.dump(meta, file)
+
+        # Rotate the store
+        for old in sorted(profile_dir.glob('*.json'), reverse=True)[get_setting('PROFILE_KEEP'):]:
+            old.unlink(missing_ok=True)
+            old.with_suffix('.prof').unlink(missing_ok=True)
+        return profile_id
@@ -0,0 +1,64 @@
+from django.core.cache import caches
+
+from .conf import get_setting, is_shared_cache
+
+
+MANAGER = 'Manager'
+DELIVERY_CREW = 'Delivery Crew'
+CUSTOMER = 'Customer'
+
+
+# Return the cache of the roles, None when it is local to the process: the
+# invalidation made by one worker would not reach the others, which would keep
+# granting the roles a user has lost
+def _get_cache():
+    cache = caches[get_setting('CACHE_ALIAS')]
+    return cache if is_shared_cache(cache) else None
+
+
+def _key(user_id):
+    return f'roles:{user_id}'
+
+
+# Return the names of the groups of the user.
+# The names are cached per user (in a shared cache only) and memoized on the user
+# object for the request.
+def get_user_roles(user):
+    if not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_little_lemon_roles', None)
+    if roles is None:
+        cache = _get_cache()
+        roles = cache.get(_key(user.id)) if cache else None
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            if cache:
+                cache.set(_key(user.id), roles, get_setting('ROLES_TIMEOUT'))
+        user._little_lemon_roles = roles
+    return roles
+
+
+# Forget the cached roles of the users (their groups have changed)
+def invalidate_user_roles(*user_ids):
+    caches[get_setting('CACHE_ALIAS')].delete_many([_key(user_id) for user_id in user_ids])
+
+
+def _group_key(name):
+    return 'group:' + name.replace(' ', '-')
+
+
+# Return the id of the group, cached by name
+def get_group_id(name):
+    cache = _get_cache()
+    group_id = cache.get(_group_key(name)) if cache else None
+    if group_id is None:
+        from django.contrib.auth.models import Group
+        group_id = Group.objects.get(name=name).id
+        if cache:
+            cache.set(_group_key(name), group_id, None)
+    return group_id
+
+
+# Forget the cached ids of the groups (a group has been renamed or deleted)
+def invalidate_group_ids(*names):
+    caches[get_setting('CACHE_ALIAS')].delete_many([_group_key(name) for name in names])
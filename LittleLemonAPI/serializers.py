@@ -1,9 +1,68 @@
 from rest_framework import serializers
 from .models import Category, MenuItem, Cart, Order, OrderItem
 from django.contrib.auth.models import User
+from decimal import Decimal
 
 
-class MenuItemSerializer(serializers.ModelSerializer):
+# Split a comma separated query parameter (None when the parameter is missing)
+def parse_field_list(request, name):
+    if request is None or name not in request.query_params:
+        return None
+    return {field.strip() for field in request.query_params[name].split(',') if field.strip()}
+
+
+# Model serializer limited to the fields requested with ?fields=id,status,total.
+# The related fields listed in expandable_fields (field name -> prefetch lookup)
+# are included with ?fields= only when requested there or with ?expand=.
+# Without ?fields= every field is included.
+class SparseFieldsSerializer(serializers.ModelSerializer):
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_fields(self.context.get('request'))
+        if requested is not None:
+            for field_name in set(self.fields) - requested:
+                self.fields.pop(field_name)
+
+    # Return the names of the requested fields (None for all of them)
+    @classmethod
+    def requested_fields(cls, request):
+        # Writes always go through every field
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return None
+        # A missing or empty ?fields= asks for every field
+        fields = parse_field_list(request, 'fields')
+        if not fields:
+            return None
+        requested = fields | (parse_field_list(request, 'expand') or set())
+        unknown = requested - cls.field_names()
+        if unknown:
+            raise serializers.ValidationError({'fields': [f'Unknown field: {name}' for name in sorted(unknown)]})
+        return requested
+
+    # Return the names of all the fields of the serializer (built once per class)
+    @classmethod
+    def field_names(cls):
+        if '_field_names' not in cls.__dict__:
+            cls._field_names = frozenset(cls().fields)
+        return cls._field_names
+
+    # Load only the columns and the related rows the response needs
+    @classmethod
+    def optimize_queryset(cls, queryset, request):
+        requested = cls.requested_fields(request)
+        prefetch = [lookup for field_name, lookup in cls.expandable_fields.items()
+                    if requested is None or field_name in requested]
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if requested is not None:
+            columns = {field.name for field in cls.Meta.model._meta.concrete_fields} & requested
+            queryset = queryset.only(*columns)
+        return queryset
+
+
+class MenuItemSerializer(SparseFieldsSerializer):
     class Meta:
         model = MenuItem
         fields = '__all__'
@@ -15,28 +74,39 @@ class UserSerializer(serializers.ModelSerializer):
         fields = '__all__'
         
         
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsSerializer):
     class Meta:
         model = Cart
-        fields = '__all__'
+        # updated is only used to purge abandoned carts
+        exclude = ('updated',)
         
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsSerializer):
     class Meta:
         model = OrderItem
         fields = '__all__'
         
         
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsSerializer):
         
     order_item = OrderItemSerializer(many=True, read_only=True, source='orderitem_set')
+    expandable_fields = {'order_item': 'orderitem_set'}
 
     class Meta:
         model = Order
         fields = '__all__'
         
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsSerializer):
     class Meta:
         model = Category
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+        
+        
+# One row of a menu file (see menu_import.py), the category is given by its slug
+class MenuImportSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False, min_value=1)
+    title = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=Decimal('0.01'))
+    featured = serializers.BooleanField(required=False)
+    category = serializers.SlugField()
\ No newline at end of file
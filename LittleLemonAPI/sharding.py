@@ -0,0 +1,182 @@
+import heapq
+from functools import cmp_to_key
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+from rest_framework.exceptions import ValidationError
+
+from .conf import get_setting
+
+
+# Cart, Order and OrderItem rows are placed by user across the database aliases
+# listed in LITTLE_LEMON['SHARDS']; every other table stays in the default database.
+# Order ids are allocated so that id % len(shards) is the index of the shard of the
+# user, so an order is found from its id alone. Without SHARDS everything lives in
+# the default database and these helpers are no-ops.
+
+SHARDED_MODELS = ('cart', 'order', 'orderitem', 'sequence')
+
+
+def get_shards():
+    return tuple(get_setting('SHARDS')) or ('default',)
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'LittleLemonAPI' and model._meta.model_name in SHARDED_MODELS
+
+
+# Return the database alias of the carts and orders of the user
+def shard_for_user(user_id):
+    shards = get_shards()
+    return shards[int(user_id) % len(shards)]
+
+
+# Return the database alias of the order
+def shard_for_order(order_id):
+    shards = get_shards()
+    return shards[int(order_id) % len(shards)]
+
+
+# Insert a new order in the shard of its user with an id pointing to that shard
+def save_order(order):
+    shards = get_shards()
+    using = shard_for_user(order.user_id)
+    if len(shards) == 1:
+        order.save(using=using)
+        return order
+
+    with transaction.atomic(using=using):
+        order.id = _next_order_id(using, shards.index(using), len(shards))
+        order.save(using=using, force_insert=True)
+    return order
+
+
+# Return the next order id of the shard from its sequence, so that the id of a
+# deleted order is never handed out again. The UPDATE locks the sequence row
+# (the whole database with SQLite) until the order is committed.
+def _next_order_id(using, index, stride):
+    from .models import Order, Sequence
+
+    sequences = Sequence.objects.using(using).filter(name='order')
+    if not sequences.update(last_value=F('last_value') + stride):
+        # First order since the sequence exists: continue after the orders of the shard
+        last_id = Order.objects.using(using).aggregate(last_id=Max('id'))['last_id'] or 0
+        try:
+            with transaction.atomic(using=using):
+                Sequence.objects.using(using).create(
+                    name='order', last_value=last_id + 1 + (index - last_id - 1) % stride)
+        except IntegrityError:
+            # Created by a concurrent checkout meanwhile
+            sequences.update(last_value=F('last_value') + stride)
+    return sequences.get().last_value
+
+
+# Compare two rows by an ordering such as ['-date', 'id'] (None first)
+def _compare(ordering):
+    def compare(a, b):
+        for attname, descending in ordering:
+            x, y = getattr(a, attname), getattr(b, attname)
+            if x == y:
+                continue
+            if x is None or (y is not None and x < y):
+                result = -1
+            else:
+                result = 1
+            return -result if descending else result
+        return 0
+    return compare
+
+
+# Read-only view over the same queryset on every shard, merging the rows by the
+# queryset ordering. Supports what the paginator needs: count() and slicing.
+# The rows can only be ordered by columns of the model: ordering by a related
+# field (e.g. user__username) raises a ValidationError (a 400 in the views).
+class ShardedQuerySet:
+    def __init__(self, queryset):
+        self.model = queryset.model
+        fields = {name: field for field in self.model._meta.concrete_fields
+                  for name in (field.name, field.attname)}
+        ordering = []
+        for name in list(queryset.query.order_by) + ['id']:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name == 'pk':
+                name = 'id'
+            # Only ordering by the columns of the model can be merged
+            if name not in fields:
+                raise ValidationError({'ordering': [f'Ordering by {name} is not supported']})
+            if fields[name] not in [field for field, d in ordering]:
+                ordering.append((fields[name], descending))
+        self.ordering = [(field.attname, descending) for field, descending in ordering]
+
+        # Columns used by the merge must be loaded together with the rows
+        loaded, deferred = queryset.query.deferred_loading
+        if loaded and not deferred:
+            queryset = queryset.only(*loaded, *[field.name for field, descending in ordering])
+        order_by = [('-' if descending else '') + field.name for field, descending in ordering]
+        self.querysets = [queryset.using(shard).order_by(*order_by) for shard in get_shards()]
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def exists(self):
+        return any(queryset.exists() for queryset in self.querysets)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+        start, stop = key.start or 0, key.stop
+        # Every shard returns its first `stop` rows, the merge keeps the global first `stop`
+        parts = [queryset[:stop] if stop is not None else queryset for queryset in self.querysets]
+        merged = heapq.merge(*parts, key=cmp_to_key(_compare(self.ordering)))
+        return list(merged)[start:stop]
+
+
+# Return the queryset over all shards (the queryset itself with a single database)
+def scatter(queryset):
+    if len(get_shards()) == 1:
+        return queryset
+    return ShardedQuerySet(queryset)
+
+
+# Place Cart, Order and OrderItem rows in the shard of their user
+class ShardRouter:
+
+    def _db_for(self, model, instance):
+        if not is_sharded(model) or len(get_shards()) == 1:
+            return None
+        if instance is None:
+            return None
+        if is_sharded(instance.__class__):
+            if instance._state.db:
+                return instance._state.db
+            if instance._meta.model_name == 'orderitem':
+                return shard_for_order(instance.order_id)
+            return shard_for_user(instance.user_id)
+        # Reverse relations of a user (user.cart_set, user.order_set)
+        if instance._meta.label == 'auth.User':
+            return shard_for_user(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints.get('instance'))
+
+    # Carts and orders reference users and menu items of the default database
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(obj1.__class__) or is_sharded(obj2.__class__):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default' or db not in get_shards():
+            return None
+        return app_label == 'LittleLemonAPI' and model_name in SHARDED_MODELS
@@ -1,6 +1,11 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
 from django.dispatch import receiver
 from djoser.signals import user_registered
 
+from .roles import invalidate_user_roles, invalidate_group_ids
+from .versions import bump_on_commit
+
 # Adding every new user to the customer group
 @receiver(user_registered)
 def add_to_default_group(sender, user, request, **kwargs):
@@ -8,3 +13,104 @@ def add_to_default_group(sender, user, request, **kwargs):
     group_name = 'Customer'
     group, created = Group.objects.get_or_create(name=group_name)
     user.groups.add(group)
+
+
+# Remember who the order belonged to when it was loaded
+@receiver(post_init, sender='LittleLemonAPI.Order')
+def remember_order_users(sender, instance, **kwargs):
+    # Read the attributes directly, a deferred field would be loaded from the database
+    instance._loaded_users = (instance.__dict__.get('user_id'), instance.__dict__.get('delivery_crew_id'))
+
+
+# Invalidate the order lists of the customer and the delivery crew (before and after the write)
+@receiver(post_save, sender='LittleLemonAPI.Order')
+@receiver(post_delete, sender='LittleLemonAPI.Order')
+def bump_order_versions(sender, instance, **kwargs):
+    names = ['orders', f'order:{instance.id}']
+    for user_id, crew_id in {instance._loaded_users, (instance.user_id, instance.delivery_crew_id)}:
+        names.append(f'orders:user:{user_id}' if user_id else None)
+        names.append(f'orders:crew:{crew_id}' if crew_id else None)
+    bump_on_commit(*names, using=instance._state.db)
+    instance._loaded_users = (instance.user_id, instance.delivery_crew_id)
+
+
+@receiver(post_save, sender='LittleLemonAPI.OrderItem')
+@receiver(post_delete, sender='LittleLemonAPI.OrderItem')
+def bump_order_item_versions(sender, instance, **kwargs):
+    from .models import Order
+    order = Order.objects.using(instance._state.db).filter(id=instance.order_id).values(
+        'user_id', 'delivery_crew_id').first()
+    names = ['orders', f'order:{instance.order_id}']
+    if order:
+        names.append(f'orders:user:{order["user_id"]}')
+        names.append(f'orders:crew:{order["delivery_crew_id"]}' if order['delivery_crew_id'] else None)
+    bump_on_commit(*names, using=instance._state.db)
+
+
+@receiver(post_save, sender='LittleLemonAPI.Cart')
+@receiver(post_delete, sender='LittleLemonAPI.Cart')
+def bump_cart_version(sender, instance, **kwargs):
+    bump_on_commit(f'cart:{instance.user_id}', using=instance._state.db)
+
+
+# Invalidate the cached menu
+@receiver(post_save, sender='LittleLemonAPI.MenuItem')
+@receiver(post_delete, sender='LittleLemonAPI.MenuItem')
+def bump_menu_version(sender, instance, **kwargs):
+    bump_on_commit('menu')
+
+
+# The carts and order lines of the shards reference menu items without a database
+# constraint: cascade the deletion of a menu item to them like in the default database
+@receiver(post_delete, sender='LittleLemonAPI.MenuItem')
+def delete_sharded_menu_item_rows(sender, instance, using, **kwargs):
+    from .models import Cart, OrderItem
+    from .sharding import get_shards
+
+    # The id of the instance is reset once it is deleted
+    menuitem_id = instance.id
+
+    def cascade():
+        for shard in get_shards():
+            if shard != using:
+                Cart.objects.using(shard).filter(menuitem_id=menuitem_id).delete()
+                OrderItem.objects.using(shard).filter(menuitem_id=menuitem_id).delete()
+    transaction.on_commit(cascade, using=using)
+
+
+# Same for the carts and orders of a user, and the orders they deliver
+@receiver(post_delete, sender='auth.User')
+def delete_sharded_user_rows(sender, instance, using, **kwargs):
+    from .models import Cart, Order
+    from .sharding import get_shards
+
+    user_id = instance.id
+
+    def cascade():
+        for shard in get_shards():
+            if shard != using:
+                Cart.objects.using(shard).filter(user_id=user_id).delete()
+                Order.objects.using(shard).filter(user_id=user_id).delete()
+                # Saved one by one (SET_NULL) so the order versions are bumped
+                for order in Order.objects.using(shard).filter(delivery_crew_id=user_id):
+                    order.delivery_crew = None
+                    order.save(using=shard, update_fields=['delivery_crew'])
+    transaction.on_commit(cascade, using=using)
+
+
+# Forget the cached id of the group
+@receiver(post_save, sender='auth.Group')
+@receiver(post_delete, sender='auth.Group')
+def forget_group(sender, instance, **kwargs):
+    invalidate_group_ids(instance.name)
+
+
+# Forget the cached roles when the groups of a user change
+@receiver(m2m_changed, sender='auth.User_groups')
+def forget_user_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_user_roles(instance.id)
+    elif reverse and action in ('post_add', 'post_remove'):
+        invalidate_user_roles(*pk_set)
+    elif reverse and action == 'pre_clear':
+        invalidate_user_roles(*instance.user_set.values_list('id', flat=True))
@@ -1,3 +1,641 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .cart_store import CachedCartStore, CoalescingCartStore, DatabaseCartStore, get_cart_store
+from .coalescer import WriteCoalescer
+from .admin import EstimatedCountPaginator
+from .maintenance import MaintenanceEngine
+from .menu_import import MenuImporter, read_rows
+from .profiling import get_profile_dir, list_profiles
+from .menu import get_menu
+from .models import Cart, Category, MenuItem, Order, OrderItem
+from .roles import CUSTOMER, MANAGER, get_user_roles
+from .sharding import shard_for_user
+from .warmup import warm_caches
+
+
+# The sharding tests need the second database of LittleLemon.settings_test
+SHARD_DATABASES = {'default', 'shard1'} & set(settings.DATABASES)
+
+
+# Override entries of the LITTLE_LEMON settings dictionary
+def little_lemon(**values):
+    return override_settings(LITTLE_LEMON={**settings.LITTLE_LEMON, **values})
+
+
+# Caches stored in a temporary directory, shared by every process like in production
+class SharedCacheMixin:
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = tempfile.mkdtemp()
+        cls.cache_settings = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': f'{cls.cache_dir}/default',
+            },
+            'carts': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': f'{cls.cache_dir}/carts',
+            },
+        })
+        cls.cache_settings.enable()
+        # Class cleanups run last first, after those of the overridden settings of the class
+        cls.addClassCleanup(shutil.rmtree, cls.cache_dir, ignore_errors=True)
+        cls.addClassCleanup(cls.cache_settings.disable)
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        for cache in caches.all():
+            cache.clear()
+        get_cart_store.cache_clear()
+        self.addCleanup(get_cart_store.cache_clear)
+
+
+class MenuFixtureMixin:
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(slug='main', title='Main')
+        cls.pizza = MenuItem.objects.create(title='Pizza', price=Decimal('8.00'), featured=False, category=category)
+        cls.soup = MenuItem.objects.create(title='Soup', price=Decimal('4.50'), featured=False, category=category)
+        customers, created = Group.objects.get_or_create(name=CUSTOMER)
+        cls.customer = User.objects.create_user('customer', password='secret')
+        cls.customer.groups.add(customers)
+
+
+@little_lemon(CART_CACHE_ALIAS='carts', CART_FLUSH_INTERVAL=3600)
+class CachedCartStoreTests(SharedCacheMixin, MenuFixtureMixin, TestCase):
+
+    def cart_titles(self):
+        return sorted(Cart.objects.filter(user=self.customer).values_list('menuitem__title', flat=True))
+
+    def flush(self, store):
+        with self.captureOnCommitCallbacks(execute=True):
+            return store.flush()
+
+    def test_local_memory_cache_is_refused(self):
+        with little_lemon(CART_CACHE_ALIAS='default'), override_settings(CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with self.assertRaises(ImproperlyConfigured):
+                CachedCartStore()
+
+    def test_flush_writes_the_cart_back(self):
+        store = CachedCartStore()
+        store.add_item(self.customer, self.pizza, 2)
+        self.assertEqual(self.cart_titles(), [])
+        self.assertEqual(self.flush(store), 1)
+        self.assertEqual(self.cart_titles(), ['Pizza'])
+        # The cart is reloaded from the table once the cache is lost
+        caches['carts'].clear()
+        self.assertEqual([item.quantity for item in CachedCartStore().get_items(self.customer)], [2])
+
+    def test_flushes_of_two_processes_keep_every_item(self):
+        worker_1, worker_2 = CachedCartStore(), CachedCartStore()
+        worker_1.add_item(self.customer, self.pizza, 1)
+        worker_2.add_item(self.customer, self.soup, 1)
+        self.flush(worker_1)
+        self.flush(worker_2)
+        self.assertEqual(self.cart_titles(), ['Pizza', 'Soup'])
+
+    def test_concurrent_adds_of_two_processes_keep_every_item(self):
+        category = Category.objects.get()
+        menu_items = MenuItem.objects.bulk_create(
+            MenuItem(title=f'Item {number}', price=Decimal('1.00'), featured=False, category=category)
+            for number in range(20))
+        workers = [CachedCartStore(), CachedCartStore()]
+        # Load the cart in the cache, the threads only use the cache
+        workers[0].get_items(self.customer)
+        barrier = threading.Barrier(2)
+
+        def add(worker, items):
+            barrier.wait()
+            for menu_item in items:
+                worker.add_item(self.customer, menu_item, 1)
+
+        threads = [threading.Thread(target=add, args=(worker, menu_items[index::2]))
+                   for index, worker in enumerate(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(CachedCartStore().get_items(self.customer)), 20)
+
+    def test_checkout_empties_the_cart_once_committed(self):
+        worker_1, worker_2 = CachedCartStore(), CachedCartStore()
+        worker_1.add_item(self.customer, self.pizza, 1)
+        self.flush(worker_1)
+        worker_2.add_item(self.customer, self.soup, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                worker_1.checkout(self.customer)
+        self.assertEqual(self.cart_titles(), [])
+        self.assertEqual(worker_2.get_items(self.customer), [])
+        # The other process can not write the ordered cart back
+        self.assertEqual(self.flush(worker_2), 0)
+        self.assertEqual(self.cart_titles(), [])
+
+    def test_rolled_back_checkout_keeps_the_cart(self):
+        store = CachedCartStore()
+        store.add_item(self.customer, self.pizza, 1)
+        self.flush(store)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    store.checkout(self.customer)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(self.cart_titles(), ['Pizza'])
+        self.assertEqual(len(store.get_items(self.customer)), 1)
+
+
+    @little_lemon(CART_STORE='LittleLemonAPI.cart_store.CachedCartStore', CART_CACHE_ALIAS='carts',
+                  CART_FLUSH_INTERVAL=3600)
+    def test_import_reprices_the_carts_of_other_processes(self):
+        worker = CachedCartStore()
+        worker.add_item(self.customer, self.soup, 2)
+        get_cart_store.cache_clear()
+        report = MenuImporter().run([{'id': self.soup.id, 'title': 'Soup', 'price': '6.00', 'category': 'main'}])
+        self.assertEqual(report['carts_repriced'], 1)
+        self.assertEqual([(item.unit_price, item.price) for item in CachedCartStore().get_items(self.customer)],
+                         [(Decimal('6.00'), Decimal('12.00'))])
+        # The worker writes the new price back
+        self.flush(worker)
+        self.assertEqual(Cart.objects.get(user=self.customer).price, Decimal('12.00'))
+
+
+class ConditionalGetTests(SharedCacheMixin, MenuFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    # Make a write and run the version bumps of its transaction
+    def write(self, function, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return function(*args, **kwargs)
+
+    def assertChangedAfter(self, path, write):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        write()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def create_order(self):
+        order = self.write(Order.objects.create, user=self.customer, total=Decimal('8.00'))
+        self.write(OrderItem.objects.create, order=order, menuitem=self.pizza, quantity=1,
+                   unit_price=Decimal('8.00'), price=Decimal('8.00'))
+        return order
+
+    def test_order_write_invalidates_the_order_list(self):
+        order = self.create_order()
+        order.status = True
+        self.assertChangedAfter('/api/orders', lambda: self.write(order.save))
+
+    def test_order_item_write_invalidates_the_order(self):
+        order = self.create_order()
+        self.assertChangedAfter(f'/api/orders/{order.id}', lambda: self.write(
+            OrderItem.objects.create, order=order, menuitem=self.soup, quantity=2,
+            unit_price=Decimal('4.50'), price=Decimal('9.00')))
+
+    def test_cart_write_invalidates_the_cart(self):
+        self.write(Cart.objects.create, user=self.customer, menuitem=self.pizza, quantity=1,
+                   unit_price=Decimal('8.00'), price=Decimal('8.00'))
+        self.assertChangedAfter('/api/cart/menu-items', lambda: self.write(
+            Cart.objects.create, user=self.customer, menuitem=self.soup, quantity=1,
+            unit_price=Decimal('4.50'), price=Decimal('4.50')))
+
+    def test_wildcard_never_answers_304(self):
+        for path in ('/api/orders/99999', '/api/cart/menu-items', '/api/orders'):
+            self.assertNotEqual(self.client.get(path, HTTP_IF_NONE_MATCH='*').status_code, 304)
+
+    def test_local_memory_cache_never_answers_304(self):
+        self.create_order()
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            etag = self.client.get('/api/orders')['ETag']
+            self.assertEqual(self.client.get('/api/orders', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class RoleCacheTests(MenuFixtureMixin, TestCase):
+
+    def test_local_memory_cache_does_not_keep_lost_roles(self):
+        self.assertIn(CUSTOMER, get_user_roles(User.objects.get(pk=self.customer.pk)))
+        # Another worker removes the user from the group
+        self.customer.groups.through.objects.filter(user_id=self.customer.pk).delete()
+        self.assertEqual(get_user_roles(User.objects.get(pk=self.customer.pk)), frozenset())
+
+
+class SparseFieldsTests(SharedCacheMixin, MenuFixtureMixin, TestCase):
+    client_class = APIClient
+
+    def test_requested_fields_only(self):
+        response = self.client.get('/api/menu-items?fields=id,title')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title'})
+
+    def test_empty_fields_returns_every_field(self):
+        response = self.client.get('/api/menu-items?fields=')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title', 'price', 'featured', 'category'})
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get('/api/menu-items?fields=id,bogus')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'fields': ['Unknown field: bogus']})
+
+    def test_unknown_order_field_is_rejected(self):
+        self.client.force_authenticate(self.customer)
+        Order.objects.create(user=self.customer, total=Decimal('8.00'))
+        self.assertEqual(self.client.get('/api/orders?fields=bogus').status_code, 400)
+
+
+class MenuPriceTests(SharedCacheMixin, MenuFixtureMixin, TestCase):
+    client_class = APIClient
+
+    def test_cart_uses_the_current_price_after_the_warm_up(self):
+        self.client.force_authenticate(self.customer)
+        # Primed by the warm-up
+        self.assertIn(self.pizza.id, get_menu())
+        # Changed without bumping the menu version: the cart still reads the menu item
+        MenuItem.objects.filter(pk=self.pizza.pk).update(price=Decimal('9.50'))
+        response = self.client.post('/api/cart/menu-items', {'food_id': self.pizza.id, 'food_quantity': 2})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Cart.objects.get(user=self.customer).price, Decimal('19.00'))
+
+    def test_warm_up_skips_a_local_memory_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with self.assertNumQueries(0):
+                warm_caches()
+
+
+class PurgeCartsTests(MenuFixtureMixin, TestCase):
+    client_class = APIClient
+
+    def test_only_whole_abandoned_carts_are_purged(self):
+        abandoned = User.objects.create_user('abandoned', password='secret')
+        for user in (self.customer, abandoned):
+            for menu_item in (self.pizza, self.soup):
+                Cart.objects.create(user=user, menuitem=menu_item, quantity=1,
+                                    unit_price=menu_item.price, price=menu_item.price)
+        old = timezone.now() - timedelta(days=60)
+        Cart.objects.filter(user=abandoned).update(updated=old)
+        # The customer still adds items to a cart started long ago
+        Cart.objects.filter(user=self.customer, menuitem=self.pizza).update(updated=old)
+
+        engine = MaintenanceEngine(cart_max_age=30, pause=0)
+        self.assertEqual(engine.purge_carts(), 2)
+        self.assertFalse(Cart.objects.filter(user=abandoned).exists())
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 2)
+
+    def test_cart_response_hides_the_update_time(self):
+        Cart.objects.create(user=self.customer, menuitem=self.pizza, quantity=1,
+                            unit_price=Decimal('8.00'), price=Decimal('8.00'))
+        self.client.force_authenticate(self.customer)
+        response = self.client.get('/api/cart/menu-items')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('updated', response.json()[0])
+
+
+class EstimatedCountTests(MenuFixtureMixin, TestCase):
+
+    def test_estimate_counts_the_rows_added_after_analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        category = Category.objects.get()
+        MenuItem.objects.bulk_create(
+            MenuItem(title=f'Item {number}', price=Decimal('1.00'), featured=False, category=category)
+            for number in range(10))
+        self.assertGreaterEqual(EstimatedCountPaginator(MenuItem.objects.all(), 50).count, 12)
+
+
+class BatchTests(SharedCacheMixin, MenuFixtureMixin, TestCase):
+    client_class = APIClient
+
+    def test_invalid_headers_are_a_client_error(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/batch', {'requests': [
+            {'path': '/api/menu-items', 'headers': ['Accept']},
+            {'path': '/api/menu-items', 'headers': {'Accept-Language': 'en'}},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([sub_response['status'] for sub_response in response.json()['responses']], [400, 200])
+
+
+# The writes are committed by the thread of the coalescer, outside the transaction of a TestCase
+class CoalescerTests(MenuFixtureMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.setUpTestData()
+
+    def test_failing_write_raises_in_its_request_only(self):
+        store = CoalescingCartStore()
+        store.add_item(self.customer, self.pizza, 1)
+        with self.assertRaises(IntegrityError):
+            store.add_item(self.customer, self.pizza, 1)
+        store.add_item(self.customer, self.soup, 1)
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 2)
+        self.assertEqual(store.stats()['errors'], 1)
+
+    def test_worker_survives_a_failing_batch(self):
+        store = CoalescingCartStore()
+        with mock.patch.object(WriteCoalescer, 'commit', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError), self.assertLogs('LittleLemonAPI.coalescer', 'ERROR'):
+                store.add_item(self.customer, self.pizza, 1)
+        store.add_item(self.customer, self.soup, 1)
+        self.assertEqual(list(Cart.objects.values_list('menuitem__title', flat=True)), ['Soup'])
+
+    @little_lemon(CART_STORE='LittleLemonAPI.cart_store.CoalescingCartStore')
+    def test_staff_read_the_metrics(self):
+        get_cart_store.cache_clear()
+        self.addCleanup(get_cart_store.cache_clear)
+        get_cart_store().add_item(self.customer, self.pizza, 1)
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        self.assertEqual(client.get('/api/cart/stats').status_code, 403)
+        client.force_authenticate(User.objects.create_user('staff', is_staff=True))
+        response = client.get('/api/cart/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['writes'], response.json()['batch_size_max']), (1, 1))
+        self.assertIn('commit_ms_p95', response.json())
+
+    def test_request_stops_waiting_after_the_timeout(self):
+        coalescer = WriteCoalescer(window=0, max_batch=1, timeout=0.05)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with self.assertRaises(TimeoutError):
+            coalescer.submit('default', release.wait)
+        # The next write was never started, the worker skips it
+        with self.assertRaises(TimeoutError):
+            coalescer.submit('default', Cart.objects.create, user=self.customer, menuitem=self.pizza,
+                             quantity=1, unit_price=Decimal('8.00'), price=Decimal('8.00'))
+        release.set()
+        self.assertEqual(coalescer.submit('default', Cart.objects.count), 0)
+
+
+class MenuImportTests(SharedCacheMixin, MenuFixtureMixin, TestCase):
+    client_class = APIClient
+
+    def run_import(self, rows, **options):
+        with self.captureOnCommitCallbacks(execute=True):
+            return MenuImporter(**options).run(rows)
+
+    def test_csv_and_ndjson_rows(self):
+        csv_rows = list(read_rows(BytesIO(b'\xef\xbb\xbftitle,price,featured,category\nPasta, 9.00 ,,main\n'), 'csv'))
+        self.assertEqual(csv_rows, [{'title': 'Pasta', 'price': '9.00', 'category': 'main'}])
+        ndjson_rows = list(read_rows(BytesIO(b'{"title": "Pasta", "price": "9.00"}\n\nnot json\n'), 'ndjson'))
+        self.assertEqual(ndjson_rows, [{'title': 'Pasta', 'price': '9.00'}, 'not json'])
+
+    def test_rows_create_or_update_by_id_and_title(self):
+        Category.objects.create(slug='drinks', title='Drinks')
+        report = self.run_import([
+            {'id': self.pizza.id, 'title': 'Pizza', 'price': '9.00', 'category': 'main'},
+            {'title': 'Soup', 'price': '4.50', 'featured': 'true', 'category': 'main'},
+            {'title': 'Lemonade', 'price': '3.00', 'category': 'drinks'},
+        ])
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (1, 2, 0))
+        self.assertEqual(MenuItem.objects.get(pk=self.pizza.pk).price, Decimal('9.00'))
+        self.assertTrue(MenuItem.objects.get(pk=self.soup.pk).featured)
+        lemonade = MenuItem.objects.get(title='Lemonade')
+        self.assertEqual((lemonade.category.slug, lemonade.featured), ('drinks', False))
+
+    def test_later_chunks_update_the_menu_items_of_earlier_ones(self):
+        report = self.run_import([
+            {'title': 'Pasta', 'price': '9.00', 'category': 'main'},
+            {'title': 'Soup', 'price': '4.50', 'category': 'main'},
+            {'title': 'Pasta', 'price': '9.50', 'category': 'main'},
+        ], chunk_size=2)
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (1, 1, 1))
+        self.assertEqual(MenuItem.objects.get(title='Pasta').price, Decimal('9.50'))
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        report = self.run_import([
+            {'title': 'Pasta', 'price': 'free', 'category': 'main'},
+            {'title': 'Pasta', 'price': '9.00', 'category': 'desserts'},
+            {'id': 999, 'title': 'Pasta', 'price': '9.00', 'category': 'main'},
+            'not json',
+            {'title': 'Pasta', 'price': '9.00', 'category': 'main'},
+        ])
+        self.assertEqual((report['created'], report['invalid']), (1, 4))
+        self.assertEqual(sorted(error['row'] for error in report['errors']), [1, 2, 3, 4])
+        errors = {error['row']: error['errors'] for error in report['errors']}
+        self.assertEqual(errors[2], {'category': ['Unknown category']})
+        self.assertEqual(errors[3], {'id': ['Unknown menu item']})
+
+    def test_dry_run_writes_nothing(self):
+        report = self.run_import([{'id': self.pizza.id, 'title': 'Pizza', 'price': '9.00', 'category': 'main'},
+                                  {'title': 'Pasta', 'price': '9.00', 'category': 'main'}], dry_run=True)
+        self.assertEqual((report['created'], report['updated']), (1, 1))
+        self.assertEqual(MenuItem.objects.get(pk=self.pizza.pk).price, Decimal('8.00'))
+        self.assertFalse(MenuItem.objects.filter(title='Pasta').exists())
+
+    def test_price_change_reprices_the_carts(self):
+        DatabaseCartStore().add_item(self.customer, self.pizza, 2)
+        DatabaseCartStore().add_item(self.customer, self.soup, 1)
+        report = self.run_import([{'id': self.pizza.id, 'title': 'Pizza', 'price': '9.00', 'category': 'main'}])
+        self.assertEqual(report['carts_repriced'], 1)
+        self.assertEqual(dict(Cart.objects.values_list('menuitem__title', 'price')),
+                         {'Pizza': Decimal('18.00'), 'Soup': Decimal('4.50')})
+
+    def test_endpoint_dry_run_flag(self):
+        manager = User.objects.create_user('manager', password='secret')
+        manager.groups.add(Group.objects.create(name=MANAGER))
+        self.client.force_authenticate(manager)
+        body = 'title,price,category\nPasta,9.00,main\n'
+        for flag, created in (('1', False), ('true', False), ('0', True)):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/api/menu-items/import?dry_run={flag}', body, content_type='text/csv')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(MenuItem.objects.filter(title='Pasta').exists(), created)
+
+
+class ProfilingTests(SharedCacheMixin, MenuFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir, ignore_errors=True)
+        settings_override = little_lemon(PROFILE_DIR=profile_dir, PROFILE_SAMPLE_RATE=0, PROFILE_KEEP=200)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.staff_token = Token.objects.create(user=staff).key
+        self.customer_token = Token.objects.create(user=self.customer).key
+
+    def get(self, token, query='', **headers):
+        return self.client.get(f'/api/menu-items{query}', HTTP_AUTHORIZATION=f'Token {token}', **headers)
+
+    def test_staff_token_triggers_a_profile(self):
+        response = self.get(self.staff_token, '?profile=1')
+        self.assertEqual(response.status_code, 200)
+        profile = list_profiles()[0]
+        self.assertEqual((profile['id'], profile['trigger'], profile['user']),
+                         (response['X-Profile-Id'], 'requested', 'staff'))
+        self.assertTrue(profile['queries'])
+        self.assertTrue((get_profile_dir() / f'{profile["id"]}.prof').exists())
+        self.assertIn('X-Profile-Id', self.get(self.staff_token, HTTP_X_PROFILE='true'))
+
+    def test_disabled_flag_and_other_users_are_not_profiled(self):
+        self.assertNotIn('X-Profile-Id', self.get(self.staff_token, '?profile=0'))
+        self.assertNotIn('X-Profile-Id', self.get(self.staff_token, HTTP_X_PROFILE='false'))
+        self.assertNotIn('X-Profile-Id', self.get(self.customer_token, '?profile=1'))
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/menu-items?profile=1'))
+        self.assertEqual(list_profiles(), [])
+
+    def test_sampled_requests_are_profiled(self):
+        with little_lemon(PROFILE_SAMPLE_RATE=0.5):
+            with mock.patch('LittleLemonAPI.profiling.random.random', side_effect=[0.4, 0.6]):
+                self.assertIn('X-Profile-Id', self.client.get('/api/menu-items'))
+                self.assertNotIn('X-Profile-Id', self.client.get('/api/menu-items'))
+        self.assertEqual([profile['trigger'] for profile in list_profiles()], ['sampled'])
+
+    def test_store_keeps_the_newest_profiles(self):
+        with little_lemon(PROFILE_KEEP=2):
+            profile_ids = [self.get(self.staff_token, '?profile=1')['X-Profile-Id'] for number in range(3)]
+        self.assertEqual([profile['id'] for profile in list_profiles()], profile_ids[:0:-1])
+        self.assertEqual(len(list(get_profile_dir().glob('*.prof'))), 2)
+
+    def test_profiles_command(self):
+        profile_id = self.get(self.staff_token, '?profile=1')['X-Profile-Id']
+        output = StringIO()
+        call_command('profiles', stdout=output)
+        self.assertIn(f'{profile_id} ', output.getvalue())
+        self.assertIn('GET /api/menu-items?profile=1 (staff, requested)', output.getvalue())
+        output = StringIO()
+        call_command('profiles', profile_id, '--top', '3', stdout=output)
+        self.assertIn('Slowest queries', output.getvalue())
+        self.assertIn('function calls', output.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('profiles', 'missing', stdout=StringIO())
+        call_command('profiles', '--clear', stdout=StringIO())
+        self.assertEqual(list_profiles(), [])
+
+
+@skipUnless(len(SHARD_DATABASES) == 2, 'needs the shard1 database of LittleLemon.settings_test')
+@little_lemon(SHARDS=['default', 'shard1'])
+class ShardedOrderTests(SharedCacheMixin, MenuFixtureMixin, TestCase):
+    databases = SHARD_DATABASES
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # The next user id, so the carts and orders of the two customers are in different shards
+        cls.other = User.objects.create_user('other', password='secret')
+        cls.other.groups.add(Group.objects.get(name=CUSTOMER))
+        cls.manager = User.objects.create_user('manager', password='secret')
+        cls.manager.groups.add(Group.objects.create(name=MANAGER))
+
+    # Run the version bumps of both databases
+    def write(self, function, *args, **kwargs):
+        with self.captureOnCommitCallbacks(using='shard1', execute=True):
+            with self.captureOnCommitCallbacks(execute=True):
+                return function(*args, **kwargs)
+
+    def checkout(self, user, *menu_items):
+        self.client.force_authenticate(user)
+        for menu_item in menu_items:
+            response = self.write(self.client.post, '/api/cart/menu-items',
+                                  {'food_id': menu_item.id, 'food_quantity': 1})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.write(self.client.post, '/api/orders').status_code, 201)
+        return Order.objects.using(shard_for_user(user.id)).filter(user=user).latest('id')
+
+    def test_checkout_writes_in_the_shard_of_the_user(self):
+        self.assertNotEqual(shard_for_user(self.customer.id), shard_for_user(self.other.id))
+        for user in (self.customer, self.other):
+            shard = shard_for_user(user.id)
+            order = self.checkout(user, self.pizza, self.soup)
+            self.assertEqual(order.id % 2, ['default', 'shard1'].index(shard))
+            self.assertEqual(order.total, Decimal('12.50'))
+            self.assertEqual(OrderItem.objects.using(shard).filter(order=order).count(), 2)
+            self.assertFalse(Cart.objects.using(shard).filter(user=user).exists())
+
+    def test_order_ids_are_not_reused(self):
+        order = self.checkout(self.other, self.pizza)
+        Order.objects.using(shard_for_user(self.other.id)).filter(pk=order.pk).delete()
+        self.assertEqual(self.checkout(self.other, self.pizza).id, order.id + 2)
+
+    def test_manager_lists_the_orders_of_every_shard(self):
+        orders = [self.checkout(self.customer, self.pizza), self.checkout(self.other, self.soup)]
+        self.client.force_authenticate(self.manager)
+        response = self.client.get('/api/orders?ordering=id')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([order['id'] for order in response.json()['results']],
+                         sorted(order.id for order in orders))
+
+    def test_manager_can_not_order_by_a_related_field(self):
+        self.checkout(self.customer, self.pizza)
+        self.client.force_authenticate(self.manager)
+        for ordering in ('user__username', '-user__username'):
+            response = self.client.get(f'/api/orders?ordering={ordering}')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'ordering': ['Ordering by user__username is not supported']})
+
+    def test_user_deletion_cascades_to_every_shard(self):
+        crew = User.objects.create_user('crew', password='secret')
+        orders = [(user, self.checkout(user, self.pizza)) for user in (self.customer, self.other)]
+        for user, order in orders:
+            self.client.force_authenticate(user)
+            self.write(self.client.post, '/api/cart/menu-items', {'food_id': self.soup.id, 'food_quantity': 1})
+            order.delivery_crew = crew
+            self.write(order.save)
+
+        self.write(crew.delete)
+        for user, order in orders:
+            self.assertIsNone(Order.objects.using(shard_for_user(user.id)).get(pk=order.pk).delivery_crew_id)
+        for user, order in orders:
+            shard = shard_for_user(user.id)
+            self.write(user.delete)
+            self.assertFalse(Order.objects.using(shard).filter(user_id=order.user_id).exists())
+            self.assertFalse(OrderItem.objects.using(shard).filter(order_id=order.id).exists())
+            self.assertFalse(Cart.objects.using(shard).filter(user_id=order.user_id).exists())
+
+    def test_admin_lists_the_default_database_only(self):
+        orders = [self.checkout(self.customer, self.pizza), self.checkout(self.other, self.pizza),
+                  self.checkout(self.other, self.soup)]
+        default_orders = [order for order in orders if shard_for_user(order.user_id) == 'default']
+        self.assertEqual(EstimatedCountPaginator(Order.objects.all(), 50).count, len(default_orders))
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        response = self.client.get('/admin/LittleLemonAPI/order/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'not those of the shards shard1')
+
+    def test_order_detail_is_read_from_its_shard(self):
+        order = self.checkout(self.other, self.soup)
+        response = self.client.get(f'/api/orders/{order.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['menuitem'] for item in response.json()], [self.soup.id])
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get(f'/api/orders/{order.id}').status_code, 403)
+
+    def test_menu_item_deletion_cascades_to_every_shard(self):
+        for user in (self.customer, self.other):
+            self.checkout(user, self.soup)
+            self.write(self.client.post, '/api/cart/menu-items', {'food_id': self.soup.id, 'food_quantity': 1})
+        soup_id = self.soup.id
+        self.write(self.soup.delete)
+        for shard in ('default', 'shard1'):
+            self.assertFalse(Cart.objects.using(shard).filter(menuitem_id=soup_id).exists())
+            self.assertFalse(OrderItem.objects.using(shard).filter(menuitem_id=soup_id).exists())
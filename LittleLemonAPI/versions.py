@@ -0,0 +1,79 @@
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .conf import get_setting, is_shared_cache
+
+
+# Version counters of the per-user and per-order resources, e.g. 'cart:<user_id>',
+# 'orders:user:<user_id>', 'orders:crew:<user_id>', 'order:<order_id>' and 'orders'.
+# A missing counter starts from the current time, so a counter lost with the cache
+# never hands out a version which has already been used.
+
+def _key(name):
+    return f'version:{name}'
+
+
+def _initial():
+    return time.time_ns() // 1000
+
+
+# Return the current versions of the resources
+def get_versions(*names):
+    cache = caches[get_setting('CACHE_ALIAS')]
+    found = cache.get_many([_key(name) for name in names])
+    versions = {}
+    for name in names:
+        version = found.get(_key(name))
+        if version is None:
+            version = _initial()
+            cache.add(_key(name), version, None)
+        versions[name] = version
+    return versions
+
+
+# Increase the versions of the resources after a write
+def bump(*names):
+    cache = caches[get_setting('CACHE_ALIAS')]
+    for name in names:
+        try:
+            cache.incr(_key(name))
+        except ValueError:
+            cache.add(_key(name), _initial(), None)
+
+
+# Increase the versions once the current transaction is visible to other connections
+def bump_on_commit(*names, using=None):
+    names = [name for name in names if name is not None]
+    transaction.on_commit(lambda: bump(*names), using=using)
+
+
+# Return a strong ETag of the response the request would get at these versions
+def get_etag(request, versions, *parts):
+    raw = '|'.join([
+        request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', ''),
+        str(request.user.id),
+        *map(str, parts),
+        *(f'{name}={version}' for name, version in sorted(versions.items())),
+    ])
+    return '"%s"' % hashlib.sha1(raw.encode()).hexdigest()
+
+
+# Return a 304 response if the client already has the current representation
+def not_modified(request, etag):
+    # Versions bumped by one worker must be seen by all of them
+    if not get_setting('CONDITIONAL_GET') or not is_shared_cache(caches[get_setting('CACHE_ALIAS')]):
+        return None
+    # If-None-Match uses the weak comparison. "*" is never matched: it is checked
+    # before the resource is loaded, so it could not tell a missing order or one
+    # of another user from an existing one
+    etags = [etag.removeprefix('W/') for etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))]
+    if etag in etags:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return None
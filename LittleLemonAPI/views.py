@@ -1,27 +1,44 @@
+import os
 from rest_framework import generics, permissions, exceptions, status, viewsets, authentication, pagination, filters
-from .models import Category, MenuItem, Cart, Order, OrderItem
+from .models import Category, MenuItem, Order, OrderItem
 from .serializers import MenuItemSerializer, UserSerializer, CartSerializer, OrderSerializer, OrderItemSerializer, CategorySerializer
-from django.contrib.auth.models import User, Group
+from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from django.shortcuts import get_object_or_404
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
 from django_filters.rest_framework import DjangoFilterBackend
 from .filters import OrderFilter
 from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
+from django.db import IntegrityError, transaction
+from .cart_store import get_cart_store
+from .roles import MANAGER, DELIVERY_CREW, CUSTOMER, get_user_roles, get_group_id
+from .menu_import import MenuImporter, format_for_content_type, read_rows
+from .sharding import shard_for_user, shard_for_order, save_order, scatter
+from .batch import run_batch
+from .conf import get_setting
+from .versions import get_versions, get_etag, not_modified
 
-class CategoryView(generics.ListCreateAPIView):
+# Trim the list output and the queryset to the fields requested with ?fields= and ?expand=
+class SparseFieldsViewMixin:
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return self.get_serializer_class().optimize_queryset(queryset, self.request)
+
+
+class CategoryView(SparseFieldsViewMixin, generics.ListCreateAPIView):
     throttle_classes = [UserRateThrottle, AnonRateThrottle]
     queryset=Category.objects.all()
     serializer_class = CategorySerializer
     
     def get_permissions(self):
-        if self.request.user.groups.filter(name='Manager').exists() or self.request.user.is_staff:
+        if MANAGER in get_user_roles(self.request.user) or self.request.user.is_staff:
             return [permissions.AllowAny()]
         else:
             return [permissions.DjangoModelPermissionsOrAnonReadOnly()]
     
-class MenuItems(generics.ListCreateAPIView):
+class MenuItems(SparseFieldsViewMixin, generics.ListCreateAPIView):
     throttle_classes = [UserRateThrottle, AnonRateThrottle]
     queryset=MenuItem.objects.all()
     serializer_class=MenuItemSerializer
@@ -32,7 +49,7 @@ class MenuItems(generics.ListCreateAPIView):
     filterset_fields = '__all__'
     
     def get_permissions(self):
-        if self.request.user.groups.filter(name='Manager').exists():
+        if MANAGER in get_user_roles(self.request.user):
             return [permissions.AllowAny()]
         else:
             return [permissions.DjangoModelPermissionsOrAnonReadOnly()]
@@ -44,18 +61,45 @@ class MenuItemsDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class=MenuItemSerializer
     
     def get_permissions(self):
-        if self.request.user.groups.filter(name='Manager').exists():
+        if MANAGER in get_user_roles(self.request.user):
             return [permissions.AllowAny()]
         else:
             return [permissions.DjangoModelPermissionsOrAnonReadOnly()]
         
+# Create and update menu items from a CSV or NDJSON file streamed in the request body
+class MenuItemsImport(APIView):
+    throttle_classes = [UserRateThrottle]
+
+    # Check if manager or super user
+    def get_permissions(self):
+        user = self.request.user
+        if user.is_authenticated:
+            if MANAGER in get_user_roles(user) or user.is_staff:
+                return [permissions.AllowAny()]
+            else:
+                raise exceptions.PermissionDenied
+        else:
+            raise exceptions.AuthenticationFailed
+
+    def post(self, request):
+        file_format = format_for_content_type(request.content_type)
+        if file_format is None:
+            return Response({'message': 'Send a text/csv or application/x-ndjson body'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        # Read the body line by line instead of parsing it whole
+        dry_run = request.query_params.get('dry_run', '').lower() in ('1', 'true', 'yes')
+        importer = MenuImporter(dry_run=dry_run)
+        report = importer.run(read_rows(request.stream or [], file_format))
+        return Response(report, status=status.HTTP_200_OK)
+
+        
 class GroupManagement(viewsets.ViewSet):
     
     # Check if manager or super user
     def get_permissions(self):
         user = self.request.user
         if user.is_authenticated:
-            if user.groups.filter(name='Manager').exists() or user.is_staff:
+            if MANAGER in get_user_roles(user) or user.is_staff:
                 return [permissions.AllowAny()]
             else:
                 raise exceptions.PermissionDenied
@@ -76,8 +120,7 @@ class GroupManagement(viewsets.ViewSet):
         # Check if credentials are valid
         if not authenticate(username=request.data['username'], password=request.data['password']):
             return Response({'message': 'Credentials do not match'}, status=status.HTTP_400_BAD_REQUEST)
-        users = Group.objects.get(name=group_name)
-        users.user_set.add(user)
+        user.groups.add(get_group_id(group_name))
         return Response({"message": f"user added to the {group_name} group"}, status=status.HTTP_201_CREATED)
     
 class GroupManagementDelete(viewsets.ViewSet):
@@ -85,7 +128,7 @@ class GroupManagementDelete(viewsets.ViewSet):
     def get_permissions(self):
         user = self.request.user
         if user.is_authenticated:
-            if user.groups.filter(name='Manager').exists() or user.is_staff:
+            if MANAGER in get_user_roles(user) or user.is_staff:
                 return [permissions.AllowAny()]
             else:
                 raise exceptions.PermissionDenied
@@ -96,8 +139,7 @@ class GroupManagementDelete(viewsets.ViewSet):
     def destroy(self, request, group, id):
         group_name = group.replace('-', ' ').title()
         user = get_object_or_404(User, id=id)
-        group = Group.objects.get(name=group_name)
-        group.user_set.remove(user)
+        user.groups.remove(get_group_id(group_name))
         message = f'{user.username} deleted from the {group_name} group'
         return Response({'message': message}, status=status.HTTP_200_OK)
 
@@ -109,11 +151,17 @@ class GroupManagementDelete(viewsets.ViewSet):
 def cart_items(request):
     # Return current items for the current user
     if request.method == 'GET':
-        cart = Cart.objects.all().filter(user_id=request.user.id)
+        # Return 304 if the cart has not changed
+        etag = get_etag(request, get_versions(f'cart:{request.user.id}'))
+        response = not_modified(request, etag)
+        if response:
+            return response
+        
+        cart = get_cart_store().get_items(request.user)
         if not cart:
             return Response({'message': 'You do not have any item in the cart'}, status=status.HTTP_404_NOT_FOUND)
-        serializer = CartSerializer(cart, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        serializer = CartSerializer(cart, many=True, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK, headers={'ETag': etag})
     
     # Add the menu item to the cart of the current user
     elif request.method == 'POST':
@@ -131,26 +179,19 @@ def cart_items(request):
         menu_item_quantity = int(menu_item_quantity)
         
         menu_item = get_object_or_404(MenuItem, id=menu_item_id)
-        price = menu_item_quantity * menu_item.price
-        cart_item = Cart(
-            user=request.user,
-            menuitem=menu_item,
-            quantity=menu_item_quantity,
-            unit_price=menu_item.price,
-            price=price
-            )
-        cart_item.save()
+        try:
+            get_cart_store().add_item(request.user, menu_item, menu_item_quantity)
+        except IntegrityError:
+            return Response({'message': f'{menu_item.title} is already in the cart'},
+                            status=status.HTTP_400_BAD_REQUEST)
         message = f'{menu_item_quantity} {menu_item.title} has been added to the cart'
         return Response({'message': message}, status=status.HTTP_201_CREATED)
         
                 
     # Delete all menu items created by the current user
     elif request.method == 'DELETE':
-        # Get all the cart items of the current user
-        cart_items = Cart.objects.filter(user=request.user)
-        
-        # Delete all items
-        cart_items.delete()
+        # Delete all items of the current user
+        get_cart_store().clear(request.user)
         
         return Response({'message': 'All items has been deleted'}, status=status.HTTP_200_OK)
     
@@ -163,20 +204,24 @@ def cart_items(request):
 def order(request):
     
     # Check roles of the user
-    try:
-        user_roles = request.user.groups.all()
-    except AttributeError:
-        return Response({'message': 'User without a role'}, status=status.HTTP_401_UNAUTHORIZED)
-
-    # Get all groups
-    manager_group = Group.objects.get(name='Manager')
-    delivery_crew_group = Group.objects.get(name='Delivery Crew')
-    customer_group = Group.objects.get(name='Customer')
+    user_roles = get_user_roles(request.user)
     
     # Get method
-    if request.method == 'GET' and (manager_group in user_roles
-                                    or delivery_crew_group in user_roles
-                                    or customer_group in user_roles):
+    if request.method == 'GET' and (MANAGER in user_roles
+                                    or DELIVERY_CREW in user_roles
+                                    or CUSTOMER in user_roles):
+        
+        # Return 304 if the orders visible to this role have not changed
+        if MANAGER in user_roles:
+            version_name = 'orders'
+        elif DELIVERY_CREW in user_roles:
+            version_name = f'orders:crew:{request.user.id}'
+        else:
+            version_name = f'orders:user:{request.user.id}'
+        etag = get_etag(request, get_versions(version_name), sorted(user_roles))
+        response = not_modified(request, etag)
+        if response:
+            return response
             
         # Set pagination
         paginator = pagination.PageNumberPagination()
@@ -186,9 +231,9 @@ def order(request):
         
         # Qualify user to the right role
         #  Return all orders with order items created by all users (paginated)
-        if manager_group in user_roles:
+        if MANAGER in user_roles:
             orders = Order.objects.all()
-            if not orders:
+            if not scatter(orders).exists():
                 return Response({'message': 'There are no orders'}, status=status.HTTP_404_NOT_FOUND)
             
             # If ordering -> order by
@@ -200,20 +245,23 @@ def order(request):
                 orders = OrderFilter().check_filters(orders, request.query_params)
             
             # Return orders
+            # Merge the orders of all the shards
+            orders = scatter(OrderSerializer.optimize_queryset(orders, request))
             page = paginator.paginate_queryset(orders, request)
-            serializer = OrderSerializer(page, many=True)
+            serializer = OrderSerializer(page, many=True, context={'request': request})
             paginated_response = paginator.get_paginated_response(serializer.data)
+            paginated_response['ETag'] = etag
             return paginated_response
         
         # Return all orders with orders assigned to the delivery crew (paginated)
-        elif delivery_crew_group in user_roles:
+        elif DELIVERY_CREW in user_roles:
             
             # Get the orders
             try:
                 orders = Order.objects.all().filter(delivery_crew_id=request.user.id)
             except AttributeError as e:
                 return Response({'message': e}, status=status.HTTP_400_BAD_REQUEST)
-            if not orders:
+            if not scatter(orders).exists():
                 # In case no orders assigned            
                 message = {'message': f'No orders found assigned to {request.user.username}'}
                 return Response(message, status=status.HTTP_404_NOT_FOUND)
@@ -223,61 +271,68 @@ def order(request):
                 orders = orders.order_by(ordering)
                 
             # Return the orders
+            # Merge the orders of all the shards
+            orders = scatter(OrderSerializer.optimize_queryset(orders, request))
             page = paginator.paginate_queryset(orders, request)
-            serializer = OrderSerializer(page, many=True)
+            serializer = OrderSerializer(page, many=True, context={'request': request})
             paginated_response = paginator.get_paginated_response(serializer.data)
+            paginated_response['ETag'] = etag
             return paginated_response
         
         # Returns all orders with order items created by this user (paginated)
-        elif customer_group in user_roles:
-            orders = Order.objects.all().filter(user=request.user)
-            if not orders:
+        elif CUSTOMER in user_roles:
+            orders = Order.objects.using(shard_for_user(request.user.id)).filter(user=request.user)
+            if not orders.exists():
                 return Response({'message': 'You do not have any order'}, status=status.HTTP_404_NOT_FOUND)
             
             # If ordering -> order by
             if ordering:
                 orders = orders.order_by(ordering)
                 
+            orders = OrderSerializer.optimize_queryset(orders, request)
             page = paginator.paginate_queryset(orders, request)
-            serializer = OrderSerializer(page, many=True)
+            serializer = OrderSerializer(page, many=True, context={'request': request})
             paginated_response = paginator.get_paginated_response(serializer.data)
+            paginated_response['ETag'] = etag
             return paginated_response
         
     # POST method and check the role
-    elif request.method == 'POST' and customer_group in user_roles:
+    elif request.method == 'POST' and CUSTOMER in user_roles:
         # Create a new order item for the current user
         # Get current cart items
-        cart_items = Cart.objects.all().filter(user_id=request.user.id)
+        cart_store = get_cart_store()
+        cart_items = cart_store.get_items(request.user)
         
         # If there are no items in the cart
-        if cart_items.count() == 0:
+        if not cart_items:
             return Response({'message': 'There are no items in the cart'}, status=status.HTTP_404_NOT_FOUND)
         
         # Count total value of the order
-        total_value = 0
-        for i in cart_items.values():
-            total_value += i['price']
+        total_value = sum(i.price for i in cart_items)
             
-        # Create the order
-        order = Order(
-            user = request.user,
-            total = total_value
-        )
-        order.save()
-        
-        # Add cart items to the order items table
-        for i in cart_items.values():
-            order_item = OrderItem(
-                order = order,
-                menuitem_id = i['menuitem_id'],
-                quantity = i['quantity'],
-                unit_price = i['unit_price'],
-                price = i['price']
+        shard = shard_for_user(request.user.id)
+        with transaction.atomic(using=shard):
+            # Create the order in the shard of the user
+            order = Order(
+                user = request.user,
+                total = total_value
             )
-            order_item.save()
+            save_order(order)
             
-        # Delete all items from the cart for this user
-        Cart.objects.filter(user=request.user).delete()
+            # Add cart items to the order items table
+            OrderItem.objects.using(shard).bulk_create(
+                OrderItem(
+                    order = order,
+                    menuitem_id = i.menuitem_id,
+                    quantity = i.quantity,
+                    unit_price = i.unit_price,
+                    price = i.price
+                )
+                for i in cart_items
+            )
+                
+            # Delete all items from the cart for this user
+            cart_store.checkout(request.user)
         
         return Response({'message': 'The order has been placed'}, status=status.HTTP_201_CREATED)
 
@@ -293,21 +348,19 @@ def order(request):
 def order_detailed(request, orderId):
     
     # Check roles of the user
-    try:
-        user_roles = request.user.groups.all()
-    except AttributeError:
-        return Response({'message': 'User without a role'}, status=status.HTTP_401_UNAUTHORIZED)
-    
-    # Get all groups
-    manager_group = Group.objects.get(name='Manager')
-    delivery_crew_group = Group.objects.get(name='Delivery Crew')
-    customer_group = Group.objects.get(name='Customer')
+    user_roles = get_user_roles(request.user)
     
     # Get method and check the role
-    if request.method == 'GET' and customer_group in user_roles:
+    if request.method == 'GET' and CUSTOMER in user_roles:
+        
+        # Return 304 if the order has not changed
+        etag = get_etag(request, get_versions(f'order:{orderId}'))
+        response = not_modified(request, etag)
+        if response:
+            return response
         
         # Get all items of this order ID
-        order_items = OrderItem.objects.all().filter(order_id=orderId)
+        order_items = OrderItem.objects.using(shard_for_order(orderId)).filter(order_id=orderId)
         if not order_items:
             return Response({'message': 'The order does not exist'}, status=status.HTTP_404_NOT_FOUND)
         
@@ -316,18 +369,18 @@ def order_detailed(request, orderId):
         if request.user.id != order_user:
             return Response({'message': 'This order belongs to another user'}, status=status.HTTP_403_FORBIDDEN)
         
-        serializer = OrderItemSerializer(order_items, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        serializer = OrderItemSerializer(order_items, many=True, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK, headers={'ETag': etag})
     
     # PUT method and check the role
-    elif request.method == 'PUT' and manager_group in user_roles:
+    elif request.method == 'PUT' and MANAGER in user_roles:
         # Update or create the order
         # Get all the necessary fields
         data = request.data
         
         # Retrieve the right order
         try:
-            order = Order.objects.get(id=orderId)
+            order = Order.objects.using(shard_for_order(orderId)).get(id=orderId)
         except Order.DoesNotExist:
             return Response({'message': 'The order has not been found'}, status=status.HTTP_404_NOT_FOUND)
             # Alternative approach - update instead of 404
@@ -347,18 +400,18 @@ def order_detailed(request, orderId):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     # PATCH method
-    elif request.method == 'PATCH' and (manager_group in user_roles or delivery_crew_group in user_roles):
+    elif request.method == 'PATCH' and (MANAGER in user_roles or DELIVERY_CREW in user_roles):
         
         # Retrieve the right order
         try:
-            order = Order.objects.get(id=orderId)
+            order = Order.objects.using(shard_for_order(orderId)).get(id=orderId)
         except Order.DoesNotExist:
             return Response({'message': 'The order has not been found'}, status=status.HTTP_404_NOT_FOUND)
 
         # Qualify user to the right role
         
         # Update the order (Set a delivery crew to this order and update the order status)
-        if manager_group in user_roles:
+        if MANAGER in user_roles:
                         
             # Update the order
             serializer = OrderSerializer(order, data=request.data, partial=True)
@@ -368,7 +421,7 @@ def order_detailed(request, orderId):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         # Update the order (possible to change only the order status)
-        elif delivery_crew_group in user_roles:
+        elif DELIVERY_CREW in user_roles:
             
             # Check if the order belongs to the right employee
             if order.delivery_crew_id != request.user.id:
@@ -388,10 +441,10 @@ def order_detailed(request, orderId):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     # DELETE method and check the role
-    elif request.method == 'DELETE' and manager_group in user_roles:
+    elif request.method == 'DELETE' and MANAGER in user_roles:
         # Retrieve the right order
         try:
-            order = Order.objects.get(id=orderId)
+            order = Order.objects.using(shard_for_order(orderId)).get(id=orderId)
         except Order.DoesNotExist:
             return Response({'message': 'The order has not been found'}, status=status.HTTP_404_NOT_FOUND)
         
@@ -401,4 +454,37 @@ def order_detailed(request, orderId):
         return Response(message, status=status.HTTP_200_OK)
     
     else:
-        return Response({'message': 'You are not authorized to do this operation'}, status=status.HTTP_403_FORBIDDEN)
\ No newline at end of file
+        return Response({'message': 'You are not authorized to do this operation'}, status=status.HTTP_403_FORBIDDEN)
+
+
+# Allow only token authenticated users
+# The batch itself is not throttled, every sub-request is counted by its own view
+@api_view(['POST'])
+@authentication_classes([authentication.TokenAuthentication])
+@permission_classes([permissions.IsAuthenticated])
+@throttle_classes([])
+def batch(request):
+    # Get the sub-requests
+    specs = request.data.get('requests') if isinstance(request.data, dict) else None
+    if not isinstance(specs, list) or not specs:
+        return Response({'message': 'requests must be a non empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(specs) > get_setting('BATCH_MAX_REQUESTS'):
+        message = f'A batch can not contain more than {get_setting("BATCH_MAX_REQUESTS")} requests'
+        return Response({'message': message}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Run them with the user of this request
+    responses = run_batch(request, specs, batch, parallel=bool(request.data.get('parallel')))
+    return Response({'responses': responses}, status=status.HTTP_200_OK)
+
+
+
+# Staff only: batch size and commit latency metrics of the cart store of the
+# worker process answering (see CoalescingCartStore), each worker has its own
+@api_view(['GET'])
+@authentication_classes([authentication.TokenAuthentication])
+@permission_classes([permissions.IsAdminUser])
+def cart_stats(request):
+    cart_store = get_cart_store()
+    if not hasattr(cart_store, 'stats'):
+        return Response({'message': 'The cart store does not coalesce writes'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'pid': os.getpid(), **cart_store.stats()}, status=status.HTTP_200_OK)
\ No newline at end of file
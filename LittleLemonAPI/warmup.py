@@ -0,0 +1,92 @@
+import logging
+import time
+
+from django.core.cache import caches
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import get_resolver, resolve, reverse
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+
+from .conf import get_setting, is_shared_cache
+from .roles import MANAGER, DELIVERY_CREW, CUSTOMER, get_user_roles, get_group_id
+from .menu import get_menu
+
+
+logger = logging.getLogger(__name__)
+
+
+# Compile the URL resolver of the project and of LittleLemonAPI.urls
+def warm_urls():
+    from . import urls
+    get_resolver()
+    for pattern in urls.urlpatterns:
+        if pattern.name:
+            try:
+                reverse(pattern.name)
+            except Exception:
+                # Patterns with arguments still compile their regexes when resolving
+                pass
+    resolve('/api/menu-items')
+
+
+# Import the renderers and compile the templates of the Browsable API
+def warm_renderers():
+    for renderer_class in api_settings.DEFAULT_RENDERER_CLASSES:
+        renderer = renderer_class()
+        template = getattr(renderer, 'template', None)
+        if template:
+            get_template(template)
+    for path in ('rest_framework_xml.renderers.XMLRenderer', 'rest_framework_xml.parsers.XMLParser'):
+        try:
+            import_string(path)
+        except ImportError:
+            pass
+
+
+# Build the fields of every serializer once
+def warm_serializers():
+    from . import serializers
+    for serializer_class in (serializers.MenuItemSerializer, serializers.CategorySerializer,
+                             serializers.CartSerializer, serializers.OrderSerializer,
+                             serializers.OrderItemSerializer, serializers.UserSerializer):
+        serializer_class().fields
+
+
+# Prime the group, role and menu caches. They are only used with a shared
+# CACHE_ALIAS, with a local one there is nothing to prime.
+def warm_caches():
+    from django.contrib.auth.models import User
+    if not is_shared_cache(caches[get_setting('CACHE_ALIAS')]):
+        return
+    for name in (MANAGER, DELIVERY_CREW, CUSTOMER):
+        get_group_id(name)
+    # Staff members are few and call the most expensive endpoints
+    for user in User.objects.filter(groups__name__in=(MANAGER, DELIVERY_CREW)).distinct():
+        get_user_roles(user)
+    get_menu()
+
+
+STEPS = (
+    ('urls', warm_urls),
+    ('renderers', warm_renderers),
+    ('serializers', warm_serializers),
+    ('caches', warm_caches),
+)
+
+
+# Pay the first request costs at worker boot, return the duration of every step.
+# A failing step (e.g. the database is not migrated yet) is logged and skipped.
+def warm_up():
+    timings = {}
+    for name, step in STEPS:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.warning('Warm-up step %s failed', name, exc_info=True)
+        timings[name] = time.perf_counter() - started
+    # Do not share the connections with forked workers (gunicorn --preload)
+    connections.close_all()
+    logger.info('Warm-up done in %.3fs', sum(timings.values()))
+    return timings